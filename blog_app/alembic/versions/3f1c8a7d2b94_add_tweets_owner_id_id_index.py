@@ -0,0 +1,26 @@
+"""Add (owner_id, id DESC) index to Tweets model
+
+Revision ID: 3f1c8a7d2b94
+Revises: 98f7decd6558
+Create Date: 2026-10-17 10:02:11.418230
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c8a7d2b94'
+down_revision: Union[str, None] = '98f7decd6558'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_tweets_owner_id_id', 'tweets', ['owner_id', sa.text('id DESC')], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tweets_owner_id_id', table_name='tweets')
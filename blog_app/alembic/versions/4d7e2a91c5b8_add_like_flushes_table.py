@@ -0,0 +1,30 @@
+"""Add like_flushes table
+
+Revision ID: 4d7e2a91c5b8
+Revises: c9a3e5f17b42
+Create Date: 2026-10-17 23:41:08.517302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4d7e2a91c5b8'
+down_revision: Union[str, None] = 'c9a3e5f17b42'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'like_flushes',
+        sa.Column('key', sa.String(), primary_key=True),
+        sa.Column('flushed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('like_flushes')
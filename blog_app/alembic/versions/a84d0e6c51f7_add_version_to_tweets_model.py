@@ -0,0 +1,26 @@
+"""Add version to Tweets model
+
+Revision ID: a84d0e6c51f7
+Revises: 3f1c8a7d2b94
+Create Date: 2026-10-17 11:24:37.902114
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a84d0e6c51f7'
+down_revision: Union[str, None] = '3f1c8a7d2b94'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('tweets', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('tweets', 'version')
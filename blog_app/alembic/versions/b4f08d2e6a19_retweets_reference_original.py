@@ -0,0 +1,85 @@
+"""Retweets reference the original tweet
+
+Revision ID: b4f08d2e6a19
+Revises: e71b4c9f3a26
+Create Date: 2026-10-17 16:40:12.557031
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4f08d2e6a19'
+down_revision: Union[str, None] = 'e71b4c9f3a26'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Pairs every unmatched retweet copy with the newest older tweet that has the same text and
+# image. {owner_condition} narrows the candidates to the author stored in op_id.
+MATCH_RETWEETS = """
+    UPDATE tweets AS rt SET original_id = m.original_id
+    FROM (
+        SELECT DISTINCT ON (r.id) r.id AS retweet_id, o.id AS original_id
+        FROM tweets r
+        JOIN tweets o ON o.id < r.id
+            AND NOT COALESCE(o.retweeted, false)
+            AND o.new_tweet IS NOT DISTINCT FROM r.new_tweet
+            AND o.image_id IS NOT DISTINCT FROM r.image_id
+            {owner_condition}
+        WHERE r.retweeted AND r.original_id IS NULL
+        ORDER BY r.id, o.id DESC
+    ) AS m
+    WHERE rt.id = m.retweet_id
+"""
+
+
+def upgrade() -> None:
+    op.add_column('tweets', sa.Column('original_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('fk_tweets_original_id', 'tweets', 'tweets', ['original_id'], ['id'], ondelete='CASCADE')
+    op.create_index(op.f('ix_tweets_original_id'), 'tweets', ['original_id'], unique=False)
+
+    # op_id holds the author of the copied tweet, except for retweets of retweets, where it is
+    # the user who retweeted first; those are matched on content alone
+    op.execute(MATCH_RETWEETS.format(owner_condition="AND o.owner_id = r.op_id"))
+    op.execute(MATCH_RETWEETS.format(owner_condition=""))
+
+    # Copies whose original was deleted or edited since cannot be matched, they stay as
+    # ordinary tweets of the user who retweeted them
+    op.execute("UPDATE tweets SET retweeted = false WHERE retweeted AND original_id IS NULL")
+    op.execute("UPDATE tweets SET new_tweet = NULL, has_image = false, image_id = NULL "
+               "WHERE original_id IS NOT NULL")
+
+    # Likes of a retweet count for the tweet it shares
+    op.execute("INSERT INTO likes (user_id, tweet_id) "
+               "SELECT likes.user_id, tweets.original_id FROM likes "
+               "JOIN tweets ON tweets.id = likes.tweet_id WHERE tweets.original_id IS NOT NULL "
+               "ON CONFLICT DO NOTHING")
+    op.execute("DELETE FROM likes USING tweets "
+               "WHERE tweets.id = likes.tweet_id AND tweets.original_id IS NOT NULL")
+    op.execute("UPDATE tweets SET like_count = (SELECT count(*) FROM likes WHERE likes.tweet_id = tweets.id)")
+
+    op.drop_column('tweets', 'op_username')
+    op.drop_column('tweets', 'op_id')
+    op.drop_column('tweets', 'retweeted')
+
+
+def downgrade() -> None:
+    op.add_column('tweets', sa.Column('retweeted', sa.Boolean(), nullable=True))
+    op.add_column('tweets', sa.Column('op_id', sa.Integer(), nullable=True))
+    op.add_column('tweets', sa.Column('op_username', sa.String(), nullable=True))
+
+    op.execute("UPDATE tweets SET retweeted = (original_id IS NOT NULL)")
+    op.execute("""
+        UPDATE tweets AS rt SET new_tweet = o.new_tweet, has_image = o.has_image, image_id = o.image_id,
+                                op_id = o.owner_id
+        FROM tweets AS o
+        WHERE rt.original_id = o.id
+    """)
+
+    op.drop_index(op.f('ix_tweets_original_id'), table_name='tweets')
+    op.drop_constraint('fk_tweets_original_id', 'tweets', type_='foreignkey')
+    op.drop_column('tweets', 'original_id')
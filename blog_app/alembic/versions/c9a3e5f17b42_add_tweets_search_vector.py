@@ -0,0 +1,36 @@
+"""Add full-text search vector to Tweets model
+
+Revision ID: c9a3e5f17b42
+Revises: b4f08d2e6a19
+Create Date: 2026-10-17 18:15:29.046713
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c9a3e5f17b42'
+down_revision: Union[str, None] = 'b4f08d2e6a19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Adding a stored generated column rewrites the table once, under an exclusive lock
+    op.add_column('tweets', sa.Column(
+        'search_vector', postgresql.TSVECTOR(),
+        sa.Computed("to_tsvector('english', coalesce(new_tweet, ''))", persisted=True),
+    ))
+    # Built concurrently so that writes are not blocked while the index is created
+    with op.get_context().autocommit_block():
+        op.create_index('ix_tweets_search_vector', 'tweets', ['search_vector'], unique=False,
+                        postgresql_using='gin', postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tweets_search_vector', table_name='tweets', postgresql_using='gin')
+    op.drop_column('tweets', 'search_vector')
@@ -0,0 +1,71 @@
+"""Add images table for content-addressed storage
+
+Revision ID: d5e92b17c0a3
+Revises: a84d0e6c51f7
+Create Date: 2026-10-17 13:41:52.306719
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5e92b17c0a3'
+down_revision: Union[str, None] = 'a84d0e6c51f7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'images',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('digest', sa.String(), nullable=True),
+        sa.Column('stem', sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('kind', 'digest', name='uq_images_kind_digest'),
+    )
+    op.create_index(op.f('ix_images_id'), 'images', ['id'], unique=False)
+    op.add_column('users', sa.Column('avatar_id', sa.Integer(), nullable=True))
+
+    # Existing files keep their old names ({tweet id}.png / {user id}.png) as stems, without a digest
+    op.execute("UPDATE tweets SET image_id = NULL WHERE image_id IS NOT NULL AND NOT coalesce(has_image, false)")
+    op.execute("""
+        INSERT INTO images (kind, stem)
+        SELECT DISTINCT 'tweets', image_id::text FROM tweets WHERE image_id IS NOT NULL
+    """)
+    op.execute("""
+        UPDATE tweets SET image_id = images.id FROM images
+        WHERE images.kind = 'tweets' AND images.digest IS NULL AND images.stem = tweets.image_id::text
+    """)
+    op.execute("INSERT INTO images (kind, stem) SELECT 'avas', id::text FROM users WHERE has_pp")
+    op.execute("""
+        UPDATE users SET avatar_id = images.id FROM images
+        WHERE images.kind = 'avas' AND images.digest IS NULL AND images.stem = users.id::text
+    """)
+
+    op.create_foreign_key('tweets_image_id_fkey', 'tweets', 'images', ['image_id'], ['id'])
+    op.create_foreign_key('users_avatar_id_fkey', 'users', 'images', ['avatar_id'], ['id'])
+
+
+def downgrade() -> None:
+    op.drop_constraint('users_avatar_id_fkey', 'users', type_='foreignkey')
+    op.drop_constraint('tweets_image_id_fkey', 'tweets', type_='foreignkey')
+
+    # Content-addressed images have no {id}.png file to fall back to and are dropped from their tweets
+    op.execute("""
+        UPDATE tweets SET image_id = CASE WHEN images.digest IS NULL THEN images.stem::integer END,
+                          has_image = images.digest IS NULL
+        FROM images WHERE images.id = tweets.image_id
+    """)
+    op.execute("""
+        UPDATE users SET has_pp = false FROM images
+        WHERE images.id = users.avatar_id AND images.digest IS NOT NULL
+    """)
+
+    op.drop_column('users', 'avatar_id')
+    op.drop_index(op.f('ix_images_id'), table_name='images')
+    op.drop_table('images')
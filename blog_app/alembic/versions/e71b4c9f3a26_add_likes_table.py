@@ -0,0 +1,40 @@
+"""Add likes table
+
+Revision ID: e71b4c9f3a26
+Revises: d5e92b17c0a3
+Create Date: 2026-10-17 15:02:44.318270
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e71b4c9f3a26'
+down_revision: Union[str, None] = 'd5e92b17c0a3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'likes',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('tweet_id', sa.Integer(), sa.ForeignKey('tweets.id', ondelete='CASCADE'), primary_key=True),
+    )
+    op.add_column('tweets', sa.Column('like_count', sa.Integer(), server_default='0', nullable=False))
+
+    # The old flag did not record who liked a tweet, a set flag is kept as a like by the owner
+    op.execute("INSERT INTO likes (user_id, tweet_id) SELECT owner_id, id FROM tweets "
+               "WHERE liked AND owner_id IS NOT NULL")
+    op.execute("UPDATE tweets SET like_count = 1 WHERE liked AND owner_id IS NOT NULL")
+    op.drop_column('tweets', 'liked')
+
+
+def downgrade() -> None:
+    op.add_column('tweets', sa.Column('liked', sa.Boolean(), nullable=True))
+    op.execute("UPDATE tweets SET liked = EXISTS (SELECT 1 FROM likes WHERE likes.tweet_id = tweets.id)")
+    op.drop_column('tweets', 'like_count')
+    op.drop_table('likes')
@@ -0,0 +1,142 @@
+import argparse
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+from .. import compression, fragments
+from ..compression import BrotliEncoder, GzipEncoder
+from .dataset import random_text
+from .load import git_commit
+
+logger = logging.getLogger(__name__)
+
+CARD_START = '<li class="list-group-item">'
+
+# (encoding, level) pairs; gzip 6 and Brotli 4 are the middleware defaults
+DEFAULT_CONFIGS = (('gzip', 1), ('gzip', 6), ('gzip', 9), ('br', 1), ('br', 4), ('br', 6), ('br', 11))
+
+
+def make_payloads(count: int):
+    # Shaped like Tweets.to_dict(), with the mix of avatars, images and retweets of a real feed
+    def stem():
+        digest = f"{random.getrandbits(256):064x}"
+        return f"{digest[:2]}/{digest}"
+
+    payloads = []
+    for tweet_id in range(count, 0, -1):
+        owner_id = random.randrange(1, 500)
+        retweeted = random.random() < 0.1
+        image = stem() if random.random() < 0.1 else None
+        payloads.append({
+            'id': tweet_id, 'original_id': tweet_id - 1 if retweeted else None, 'owner_id': owner_id,
+            'retweeted': retweeted, 'username': f'user{owner_id}', 'has_pp': True, 'version': 1,
+            'new_tweet': random_text(), 'has_image': image is not None, 'image_id': None, 'image': image,
+            'op_id': owner_id + 1 if retweeted else None, 'op_username': f'user{owner_id + 1}' if retweeted else None,
+            'op_avatar': stem() if retweeted else None, 'avatar': stem() if random.random() < 0.7 else None,
+            'like_count': random.randrange(50),
+        })
+    return payloads
+
+
+def render_page(tweets: int) -> str:
+    user = {'username': 'bench', 'id': 1}
+    payloads = make_payloads(tweets)
+    cards = [fragments._splice(fragments.render_card(payload), payload, user, frozenset()) for payload in payloads]
+    template = fragments.templates.env.get_template("home.html")
+    # url_for in the context stands in for the router's, there is no request here
+    return template.render(cards=cards, user=user, page={'next_before': 1}, limit=tweets,
+                           url_for=lambda name, path: f"/static{path}")
+
+
+def stream_chunks(page: str, chunk_cards: int):
+    # The page as a streamed response sends it: the layout first, then chunk_cards cards at a time
+    parts = page.split(CARD_START)
+    chunks = [parts[0]]
+    for i in range(1, len(parts), chunk_cards):
+        chunks.append(''.join(CARD_START + part for part in parts[i:i + chunk_cards]))
+    return [chunk.encode() for chunk in chunks]
+
+
+def measure(chunks, encoding: str, level: int, repeat: int):
+    encoder_class = GzipEncoder if encoding == 'gzip' else BrotliEncoder
+    body = b''.join(chunks)
+
+    wall, cpu = [], []
+    for _ in range(repeat):
+        started, cpu_started = time.perf_counter(), time.process_time()
+        encoder = encoder_class(level)
+        whole = encoder.compress(body) + encoder.finish()
+        wall.append(time.perf_counter() - started)
+        cpu.append(time.process_time() - cpu_started)
+
+    encoder = encoder_class(level)
+    streamed = b''.join(encoder.compress(chunk) for chunk in chunks) + encoder.finish()
+
+    return {
+        'encoding': encoding,
+        'level': level,
+        'bytes': len(whole),
+        'streamed_bytes': len(streamed),
+        'ratio': round(len(body) / len(whole), 2),
+        'wall_ms': round(min(wall) * 1000, 3),
+        'cpu_ms': round(sum(cpu) / len(cpu) * 1000, 3),
+        'mb_per_s': round(len(body) / min(wall) / 1e6, 1),
+    }
+
+
+def print_report(original: int, results):
+    print(f"uncompressed page: {original} bytes")
+    print(f"{'encoding':<10} {'level':>5} {'bytes':>8} {'streamed':>9} {'ratio':>6} {'wall ms':>8} {'cpu ms':>8} "
+          f"{'MB/s':>7}")
+    for result in results:
+        print(f"{result['encoding']:<10} {result['level']:>5} {result['bytes']:>8} {result['streamed_bytes']:>9} "
+              f"{result['ratio']:>6} {result['wall_ms']:>8} {result['cpu_ms']:>8} {result['mb_per_s']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure bytes on the wire and CPU time of gzip and Brotli "
+                                                 "for a rendered feed page")
+    parser.add_argument('--tweets', type=int, default=200)
+    parser.add_argument('--chunk-cards', type=int, default=50,
+                        help="cards per streamed chunk, each chunk is flushed (default: 50)")
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--output', help="JSON file for the results (default: bench-results/<commit>-<time>.json)")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    random.seed(args.seed)
+
+    chunks = stream_chunks(render_page(args.tweets), args.chunk_cards)
+    original = sum(len(chunk) for chunk in chunks)
+    configs = [(encoding, level) for encoding, level in DEFAULT_CONFIGS
+               if encoding == 'gzip' or compression.brotli is not None]
+    if compression.brotli is None:
+        logger.warning("brotli is not installed, only gzip is measured")
+
+    results = [measure(chunks, encoding, level, args.repeat) for encoding, level in configs]
+    print_report(original, results)
+
+    commit = git_commit()
+    now = datetime.now(timezone.utc)
+    result = {
+        'benchmark': 'compression',
+        'commit': commit,
+        'timestamp': now.isoformat(),
+        'parameters': {'tweets': args.tweets, 'chunk_cards': args.chunk_cards, 'repeat': args.repeat},
+        'uncompressed_bytes': original,
+        'results': results,
+    }
+
+    output = args.output or os.path.join('bench-results', f"{commit or 'unknown'}-{now:%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    logger.info(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import random
+import time
+from pathlib import Path
+
+import asyncpg
+from PIL import Image
+from sqlalchemy.engine import make_url
+
+from ..database import SQLALCHEMY_DATABASE_URL
+from ..hashing import get_password_hash
+from ..images import IMAGE_ROOT, write_variants
+
+logger = logging.getLogger(__name__)
+
+COPY_BATCH_SIZE = 50000
+
+WORDS = (
+    'python fastapi postgres redis celery docker async await query index cache latency feed tweet '
+    'retweet like image avatar coffee morning weekend music football travel book movie city rain '
+    'sunny lunch dinner code deploy bug fix release team meeting idea today tomorrow great awful '
+    'finally again new old fast slow happy tired'
+).split()
+
+USER_COLUMNS = ('id', 'email', 'username', 'first_name', 'last_name', 'hashed_password', 'has_pp',
+                'is_active', 'role', 'phone_number', 'avatar_id')
+# search_vector is generated by Postgres and must not be listed
+TWEET_COLUMNS = ('id', 'new_tweet', 'has_image', 'image_id', 'owner_id', 'original_id', 'version', 'like_count')
+
+
+def tweet_counts(users: int, mean: float, alpha: float, cap: int):
+    # Pareto distributed, scaled to the requested mean: most users post a little, a few post a lot
+    scale = mean * (alpha - 1) / alpha
+    return [min(cap, int(scale * random.paretovariate(alpha))) for _ in range(users)]
+
+
+def random_text() -> str:
+    return ' '.join(random.choices(WORDS, k=random.randint(4, 25)))
+
+
+def write_placeholder_images(kind: str, count: int):
+    # A few real files are enough, rows share them the way duplicate uploads share one stored image
+    stems = []
+    for _ in range(count):
+        size = (800, 600) if kind == 'tweets' else (200, 200)
+        image = Image.new('RGB', size, (random.randrange(256), random.randrange(256), random.randrange(256)))
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        digest = hashlib.sha256(buffer.getvalue() + os.urandom(16)).hexdigest()
+
+        stem = f"{digest[:2]}/{digest}"
+        image_path = Path(IMAGE_ROOT, kind, f"{stem}.png").resolve()
+        image_path.parent.mkdir(parents=True, exist_ok=True)
+        image_path.write_bytes(buffer.getvalue())
+        write_variants(image, image_path, kind)
+        stems.append((digest, stem))
+    return stems
+
+
+async def next_id(connection, table: str) -> int:
+    return await connection.fetchval(f'SELECT coalesce(max(id), 0) + 1 FROM {table}')
+
+
+async def copy_batches(connection, table: str, columns, records):
+    batch = []
+    copied = 0
+    for record in records:
+        batch.append(record)
+        if len(batch) >= COPY_BATCH_SIZE:
+            await connection.copy_records_to_table(table, records=batch, columns=columns)
+            copied += len(batch)
+            batch = []
+            logger.info(f"{table}: {copied} rows copied")
+    if batch:
+        await connection.copy_records_to_table(table, records=batch, columns=columns)
+        copied += len(batch)
+    return copied
+
+
+async def load_images(connection, args):
+    rows = {}
+    for kind, count in (('tweets', args.placeholder_images), ('avas', args.placeholder_images)):
+        first_id = await next_id(connection, 'images')
+        stems = await asyncio.to_thread(write_placeholder_images, kind, count)
+        records = [(first_id + i, kind, digest, stem) for i, (digest, stem) in enumerate(stems)]
+        await connection.copy_records_to_table('images', records=records, columns=('id', 'kind', 'digest', 'stem'))
+        rows[kind] = [record[0] for record in records]
+    return rows
+
+
+def user_records(first_id: int, count: int, hashed_password: str, avatars, image_ratio: float):
+    for user_id in range(first_id, first_id + count):
+        avatar_id = random.choice(avatars) if avatars and random.random() < image_ratio else None
+        yield (user_id, f'user{user_id}@example.com', f'user{user_id}', 'Test', f'User{user_id}',
+               hashed_password, avatar_id is not None, True, None, f'{user_id:010d}', avatar_id)
+
+
+def tweet_records(first_id: int, owners, images, args):
+    # Ids follow posting order, so owners are shuffled to interleave users over time. A retweet
+    # points at an earlier original, biased towards recent ones like a real timeline.
+    originals = []
+    for offset, owner_id in enumerate(owners):
+        tweet_id = first_id + offset
+        if originals and random.random() < args.retweet_ratio:
+            original_id = originals[int(len(originals) * random.random() ** 0.3)]
+            yield tweet_id, None, False, None, owner_id, original_id, 1, 0
+            continue
+
+        image_id = random.choice(images) if images and random.random() < args.image_ratio else None
+        originals.append(tweet_id)
+        yield tweet_id, random_text(), image_id is not None, image_id, owner_id, None, 1, 0
+
+
+async def load(args):
+    dsn = make_url(SQLALCHEMY_DATABASE_URL).set(drivername='postgresql').render_as_string(hide_password=False)
+    connection = await asyncpg.connect(args.database_url or dsn)
+    started = time.monotonic()
+    try:
+        # One bcrypt hash shared by every account, hashing per user would take hours
+        hashed_password = get_password_hash(args.password)
+
+        async with connection.transaction():
+            if args.truncate:
+                await connection.execute('TRUNCATE likes, tweets, users, images RESTART IDENTITY CASCADE')
+
+            images = await load_images(connection, args) if args.placeholder_images else {}
+
+            first_user = await next_id(connection, 'users')
+            users = await copy_batches(connection, 'users', USER_COLUMNS, user_records(
+                first_user, args.users, hashed_password, images.get('avas'), args.image_ratio))
+
+            counts = tweet_counts(args.users, args.tweets_per_user, args.skew, args.max_tweets_per_user)
+            owners = [first_user + index for index, count in enumerate(counts) for _ in range(count)]
+            random.shuffle(owners)
+
+            first_tweet = await next_id(connection, 'tweets')
+            tweets = await copy_batches(connection, 'tweets', TWEET_COLUMNS,
+                                        tweet_records(first_tweet, owners, images.get('tweets'), args))
+
+            # COPY with explicit ids does not advance the sequences
+            for table in ('users', 'tweets', 'images'):
+                await connection.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), coalesce(max(id), 1)) FROM {table}"
+                )
+
+        # Fresh statistics, otherwise the planner keeps estimating for the empty tables
+        await connection.execute('ANALYZE users, tweets, images')
+    finally:
+        await connection.close()
+
+    logger.info(f"Loaded {users} users and {tweets} tweets in {time.monotonic() - started:.1f}s")
+    logger.info("Cached timelines are now stale, rebuild them with: python -m blog_app.timeline")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic dataset and load it with COPY")
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--tweets-per-user', type=float, default=20, help="mean tweets per user (default: 20)")
+    parser.add_argument('--skew', type=float, default=1.5,
+                        help="Pareto shape of tweets per user, lower is more skewed, must be > 1 (default: 1.5)")
+    parser.add_argument('--max-tweets-per-user', type=int, default=20000)
+    parser.add_argument('--retweet-ratio', type=float, default=0.1)
+    parser.add_argument('--image-ratio', type=float, default=0.05,
+                        help="share of tweets with an image and of users with a profile picture (default: 0.05)")
+    parser.add_argument('--placeholder-images', type=int, default=20,
+                        help="distinct image files generated per kind, 0 for no images (default: 20)")
+    parser.add_argument('--password', default='Password123!', help="password of every generated user")
+    parser.add_argument('--truncate', action='store_true', help="empty the tables first")
+    parser.add_argument('--database-url', default=os.getenv('DATASET_DATABASE_URL'),
+                        help="plain postgresql:// DSN, defaults to the app's DATABASE_URL")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    if args.skew <= 1:
+        parser.error("--skew must be greater than 1")
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    asyncio.run(load(args))
+
+
+if __name__ == '__main__':
+    main()
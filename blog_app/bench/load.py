@@ -0,0 +1,277 @@
+import argparse
+import asyncio
+import io
+import json
+import logging
+import math
+import os
+import random
+import re
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import httpx
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+BENCH_PASSWORD = 'BenchPassword1!'
+
+# Relative weights of the scenarios a virtual user picks from, roughly what a read-heavy
+# timeline service sees: most requests read feeds, a few write
+DEFAULT_MIX = {
+    'feed': 50,
+    'feed_older': 5,
+    'user_page': 15,
+    'like': 15,
+    'retweet': 5,
+    'post_text': 8,
+    'post_image': 2,
+}
+
+TWEET_ID = re.compile(r'likeTweet\((\d+)')
+USER_ID = re.compile(r'/tweets/users/(\d+)')
+NEXT_PAGE = re.compile(r'\?before=(\d+)')
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def make_image(size=(640, 480)) -> bytes:
+    image = Image.new('RGB', size, (random.randrange(256), random.randrange(256), random.randrange(256)))
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.recording = False
+
+    def add(self, name: str, duration: float, ok: bool):
+        if not self.recording:
+            return
+        self.samples[name].append(duration)
+        if not ok:
+            self.errors[name] += 1
+
+    def report(self, elapsed: float):
+        routes = {}
+        for name in sorted(self.samples):
+            durations = sorted(self.samples[name])
+            routes[name] = {
+                'requests': len(durations),
+                'errors': self.errors[name],
+                'throughput_rps': round(len(durations) / elapsed, 2),
+                'mean_ms': round(sum(durations) / len(durations) * 1000, 2),
+                'p50_ms': round(percentile(durations, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(durations, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(durations, 0.99) * 1000, 2),
+                'max_ms': round(durations[-1] * 1000, 2),
+            }
+        total = sum(route['requests'] for route in routes.values())
+        return {
+            'total_requests': total,
+            'total_errors': sum(route['errors'] for route in routes.values()),
+            'throughput_rps': round(total / elapsed, 2) if elapsed else 0.0,
+            'routes': routes,
+        }
+
+
+class VirtualUser:
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, known: dict, image: bytes):
+        self.client = client
+        self.recorder = recorder
+        self.known = known
+        self.image = image
+
+    async def timed(self, name: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError as e:
+            logger.debug(f"{name} failed: {e}")
+            self.recorder.add(name, time.perf_counter() - started, ok=False)
+            return None
+        # Writes answer with a redirect, anything from 400 up counts as an error
+        self.recorder.add(name, time.perf_counter() - started, ok=response.status_code < 400)
+        return response
+
+    def remember(self, html: str):
+        self.known['tweets'].extend(int(tweet_id) for tweet_id in TWEET_ID.findall(html))
+        self.known['users'].extend(int(user_id) for user_id in USER_ID.findall(html))
+        # Only the most recent ids are kept, they are what real users interact with
+        del self.known['tweets'][:-500]
+        del self.known['users'][:-500]
+
+    async def feed(self):
+        response = await self.timed('feed', 'GET', '/tweets/')
+        if response is not None and response.status_code == 200:
+            self.remember(response.text)
+            match = NEXT_PAGE.search(response.text)
+            if match:
+                self.known['before'] = int(match.group(1))
+
+    async def feed_older(self):
+        before = self.known.get('before')
+        if before is None:
+            return await self.feed()
+        await self.timed('feed_older', 'GET', '/tweets/', params={'before': before})
+
+    async def user_page(self):
+        if not self.known['users']:
+            return await self.feed()
+        response = await self.timed('user_page', 'GET', f"/tweets/users/{random.choice(self.known['users'])}")
+        if response is not None and response.status_code == 200:
+            self.remember(response.text)
+
+    async def like(self):
+        if not self.known['tweets']:
+            return await self.feed()
+        await self.timed('like', 'POST', f"/tweets/like/{random.choice(self.known['tweets'])}")
+
+    async def retweet(self):
+        if not self.known['tweets']:
+            return await self.feed()
+        await self.timed('retweet', 'POST', f"/tweets/retweet/{random.choice(self.known['tweets'])}")
+
+    async def post_text(self):
+        await self.timed('post_text', 'POST', '/tweets/add_tweet',
+                         data={'new_tweet': f"Benchmark tweet {random.randrange(10 ** 9)}"})
+
+    async def post_image(self):
+        await self.timed('post_image', 'POST', '/tweets/add_tweet',
+                         data={'new_tweet': f"Benchmark image {random.randrange(10 ** 9)}"},
+                         files={'file': ('bench.jpg', self.image, 'image/jpeg')})
+
+
+async def log_in(client: httpx.AsyncClient, username: str):
+    await client.post('/auth/', data={'email': username, 'password': BENCH_PASSWORD})
+    if 'access_token' in client.cookies:
+        return True
+
+    # First run against this database: create the account, then log in again
+    await client.post('/auth/register', data={
+        'email': f'{username}@bench.local', 'username': username, 'firstname': 'Bench', 'lastname': 'User',
+        'phonenumber': '0000000000', 'password': BENCH_PASSWORD, 'repeat_password': BENCH_PASSWORD,
+    })
+    response = await client.post('/auth/', data={'email': username, 'password': BENCH_PASSWORD})
+    if 'access_token' not in client.cookies:
+        logger.error(f"Could not log in as {username}: HTTP {response.status_code}")
+        return False
+    return True
+
+
+async def run_user(index: int, args, recorder: Recorder, known: dict, mix: dict, deadline: float):
+    limits = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        if not await log_in(client, f'{args.user_prefix}{index}'):
+            return
+
+        user = VirtualUser(client, recorder, known, make_image())
+        scenarios = list(mix)
+        weights = [mix[name] for name in scenarios]
+        while time.monotonic() < deadline:
+            await getattr(user, random.choices(scenarios, weights)[0])()
+            if args.think_time:
+                await asyncio.sleep(random.expovariate(1 / args.think_time))
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args, mix: dict):
+    recorder = Recorder()
+    known = {'tweets': [], 'users': []}
+    started = time.monotonic()
+    deadline = started + args.warmup + args.duration
+
+    users = [asyncio.create_task(run_user(i, args, recorder, known, mix, deadline)) for i in range(args.users)]
+
+    # Samples taken while connections, pools and caches warm up are not part of the result
+    await asyncio.sleep(args.warmup)
+    recorder.recording = True
+    measured_from = time.monotonic()
+    await asyncio.gather(*users)
+
+    return recorder.report(time.monotonic() - measured_from)
+
+
+def print_report(report: dict):
+    print(f"{'route':<12} {'reqs':>7} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, route in report['routes'].items():
+        print(f"{name:<12} {route['requests']:>7} {route['errors']:>5} {route['throughput_rps']:>8} "
+              f"{route['p50_ms']:>9} {route['p95_ms']:>9} {route['p99_ms']:>9} {route['max_ms']:>9}")
+    print(f"total: {report['total_requests']} requests, {report['total_errors']} errors, "
+          f"{report['throughput_rps']} req/s")
+
+
+def parse_mix(value: str) -> dict:
+    # "feed=60,like=20,post_text=20"
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}, expected one of {', '.join(DEFAULT_MIX)}")
+        mix[name] = float(weight)
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a realistic request mix against a running app and "
+                                                 "report latency percentiles and throughput per route")
+    parser.add_argument('--base-url', default=os.getenv('BENCH_BASE_URL', 'http://localhost:8000'))
+    parser.add_argument('--users', type=int, default=20, help="concurrent virtual users (default: 20)")
+    parser.add_argument('--duration', type=float, default=60, help="measured seconds (default: 60)")
+    parser.add_argument('--warmup', type=float, default=10, help="seconds before measuring starts (default: 10)")
+    parser.add_argument('--think-time', type=float, default=0,
+                        help="mean pause between a user's requests in seconds, 0 for a closed loop (default: 0)")
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--user-prefix', default='bench_user_', help="accounts are created on first use")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help="scenario weights, e.g. feed=60,like=20,post_text=20")
+    parser.add_argument('--output', help="JSON file for the results (default: bench-results/<commit>-<time>.json)")
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    report = asyncio.run(run(args, args.mix))
+    print_report(report)
+
+    commit = git_commit()
+    now = datetime.now(timezone.utc)
+    result = {
+        'benchmark': 'load',
+        'commit': commit,
+        'timestamp': now.isoformat(),
+        'parameters': {'base_url': args.base_url, 'users': args.users, 'duration': args.duration,
+                       'warmup': args.warmup, 'think_time': args.think_time, 'mix': args.mix},
+        **report,
+    }
+
+    output = args.output or os.path.join('bench-results', f"{commit or 'unknown'}-{now:%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    logger.info(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import argparse
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+from ..routers.api import serialize_tweet
+from .compression import make_payloads
+from .load import git_commit
+
+logger = logging.getLogger(__name__)
+
+RENDERERS = {'json': JSONResponse, 'orjson': ORJSONResponse}
+
+
+def best_of(func, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def measure(tweets: int, repeat: int):
+    payloads = make_payloads(tweets)
+    liked_ids = {payload['id'] for payload in payloads[::3]}
+    page = {'tweets': [serialize_tweet(payload, liked_ids) for payload in payloads], 'next_before': 1}
+
+    shaping = best_of(lambda: [serialize_tweet(payload, liked_ids) for payload in payloads], repeat)
+    results = {'shaping': {'page_ms': round(shaping * 1000, 3), 'per_tweet_us': round(shaping / tweets * 1e6, 2)}}
+    for name, response_class in RENDERERS.items():
+        # Building the response encodes the body, sending it is the same for both
+        seconds = best_of(lambda: response_class(page), repeat)
+        results[name] = {
+            'bytes': len(response_class(page).body),
+            'page_ms': round(seconds * 1000, 3),
+            'per_tweet_us': round(seconds / tweets * 1e6, 2),
+        }
+    return results
+
+
+def print_report(tweets: int, results: dict):
+    print(f"{tweets} tweets per page")
+    print(f"{'step':<10} {'bytes':>8} {'page ms':>9} {'us/tweet':>9}")
+    for name, result in results.items():
+        print(f"{name:<10} {result.get('bytes', ''):>8} {result['page_ms']:>9} {result['per_tweet_us']:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cost per tweet of shaping and encoding API responses "
+                                                 "with the stdlib json module and with orjson")
+    parser.add_argument('--tweets', type=int, default=100, help="tweets per page (default: 100, the API maximum)")
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--output', help="JSON file for the results (default: bench-results/<commit>-<time>.json)")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    random.seed(args.seed)
+
+    results = measure(args.tweets, args.repeat)
+    print_report(args.tweets, results)
+
+    commit = git_commit()
+    now = datetime.now(timezone.utc)
+    result = {
+        'benchmark': 'serialization',
+        'commit': commit,
+        'timestamp': now.isoformat(),
+        'parameters': {'tweets': args.tweets, 'repeat': args.repeat},
+        'results': results,
+    }
+
+    output = args.output or os.path.join('bench-results', f"{commit or 'unknown'}-{now:%Y%m%dT%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    logger.info(f"Results written to {output}")
+
+
+if __name__ == '__main__':
+    main()
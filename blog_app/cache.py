@@ -0,0 +1,7 @@
+import os
+
+from redis.asyncio import Redis
+
+REDIS_URL = os.getenv('REDIS_URL', 'redis://redis:6379/1')
+
+redis_client = Redis.from_url(REDIS_URL, decode_responses=True)
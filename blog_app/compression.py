@@ -0,0 +1,143 @@
+import os
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+from .static_files import accepted_encodings
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() == 'true'
+# Below this many bytes the headers and framing cost more than compression saves
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', 500))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', 6))
+# Brotli above 5 costs a lot more CPU for a few percent on HTML, 11 is for build time only
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 4))
+
+# Text formats only; images, fonts and archives are compressed already
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/xml', 'image/svg+xml',
+                      'application/openmetrics-text')
+
+
+def is_compressible(content_type: str) -> bool:
+    return content_type.lower().startswith(COMPRESSIBLE_TYPES)
+
+
+def choose_encoding(accept_encoding: str):
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+class GzipEncoder:
+    def __init__(self, level: int = None):
+        # wbits=31 writes the gzip container instead of a raw zlib stream
+        self._compressor = zlib.compressobj(GZIP_LEVEL if level is None else level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        # A sync flush puts everything received so far on the wire, a streamed page must not stall
+        # in the compressor's window
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliEncoder:
+    def __init__(self, quality: int = None):
+        self._compressor = brotli.Compressor(quality=BROTLI_QUALITY if quality is None else quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self) -> bytes:
+        return self._compressor.finish()
+
+
+ENCODERS = {'gzip': GzipEncoder, 'br': BrotliEncoder}
+
+
+class CompressionMiddleware:
+    # Compresses text responses with Brotli or gzip. A body sent in one message is compressed
+    # whole if it is at least COMPRESSION_MIN_SIZE bytes; a streamed body is compressed chunk by
+    # chunk, every chunk flushed as it arrives.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        start_message = None
+        encoder = None
+        passthrough = False
+
+        async def send_compressed(message):
+            nonlocal start_message, encoder, passthrough
+
+            if message['type'] == 'http.response.start':
+                headers = Headers(raw=message['headers'])
+                if not is_compressible(headers.get('content-type', '')) or 'content-encoding' in headers:
+                    passthrough = True
+                    await send(message)
+                    return
+                # Caches must keep the encodings apart, even when this client gets identity.
+                # Static files may have said so already.
+                headers = MutableHeaders(scope=message)
+                vary = {token.strip().lower() for token in headers.get('vary', '').split(',')}
+                if 'accept-encoding' not in vary and '*' not in vary:
+                    headers.add_vary_header('Accept-Encoding')
+                if encoding is None:
+                    passthrough = True
+                    await send(message)
+                    return
+                start_message = message
+                return
+
+            if passthrough or message['type'] != 'http.response.body':
+                await send(message)
+                return
+
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+            if encoder is None:
+                if not more_body and len(body) < COMPRESSION_MIN_SIZE:
+                    passthrough = True
+                    await send(start_message)
+                    await send(message)
+                    return
+
+                encoder = ENCODERS[encoding]()
+                headers = MutableHeaders(scope=start_message)
+                headers['Content-Encoding'] = encoding
+                etag = headers.get('etag')
+                if etag and not etag.startswith('W/'):
+                    # The compressed bytes differ from the ones a strong validator stands for
+                    headers['ETag'] = f'W/{etag}'
+
+                if not more_body:
+                    compressed = encoder.compress(body) + encoder.finish()
+                    headers['Content-Length'] = str(len(compressed))
+                    await send(start_message)
+                    await send({'type': 'http.response.body', 'body': compressed})
+                    return
+
+                del headers['Content-Length']
+                await send(start_message)
+
+            data = encoder.compress(body) if body else b''
+            if not more_body:
+                data += encoder.finish()
+            if data or not more_body:
+                await send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+
+        await self.app(scope, receive, send_compressed)
@@ -1,26 +1,198 @@
 import logging
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
+import os
+import time
+import uuid
+
+from prometheus_client import Gauge, Histogram
+from starlette.datastructures import MutableHeaders
+from starlette.requests import Request
+from sqlalchemy import text, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool
 
 logger = logging.getLogger(__name__)
 
-SQLALCHEMY_DATABASE_URL = 'postgresql://postgres:test1234!@db:5432/NewTwitterDatabase'
+DEFAULT_DATABASE_URL = 'postgresql+asyncpg://postgres:test1234!@db:5432/NewTwitterDatabase'
+
+# Pool size is per process: with N workers the database sees up to N * (size + overflow) connections
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+# Behind PgBouncer in transaction mode the bouncer does the pooling, and a server connection
+# can change between statements, so prepared statements cannot be cached
+DB_PGBOUNCER = os.getenv('DB_PGBOUNCER', 'false').lower() == 'true'
+
+# Arbitrary application-wide id of the advisory lock taken around schema creation
+SCHEMA_LOCK_KEY = 7263514001
+
+# livesum adds up the pools of all live worker processes when metrics are multiprocess
+POOL_SIZE = Gauge('db_pool_size', 'Connections the pool keeps open', ['engine'], multiprocess_mode='livesum')
+POOL_CHECKED_OUT = Gauge('db_pool_checked_out', 'Connections currently checked out of the pool', ['engine'],
+                         multiprocess_mode='livesum')
+POOL_OVERFLOW = Gauge('db_pool_overflow', 'Connections open beyond the pool size', ['engine'],
+                      multiprocess_mode='livesum')
+POOL_WAIT = Histogram(
+    'db_pool_wait_seconds', 'Time spent getting a connection from the pool', ['engine'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+
+def normalize_database_url(url: str) -> str:
+    # docker-compose hands out postgres:// URLs, the application always talks through asyncpg
+    for prefix in ('postgres://', 'postgresql://', 'postgresql+psycopg2://'):
+        if url.startswith(prefix):
+            return 'postgresql+asyncpg://' + url[len(prefix):]
+    return url
+
+
+SQLALCHEMY_DATABASE_URL = normalize_database_url(os.getenv('DATABASE_URL', DEFAULT_DATABASE_URL))
+# Optional streaming replica for read-only endpoints; the same DSN as DATABASE_URL also works
+SQLALCHEMY_READ_DATABASE_URL = normalize_database_url(os.getenv('DATABASE_READ_URL', ''))
+
+# After a write the client reads from the primary for this many seconds, longer than the
+# replica usually lags, so people see their own tweets right away
+READ_YOUR_WRITES_WINDOW = int(os.getenv('READ_YOUR_WRITES_WINDOW', 10))
+STICKY_PRIMARY_COOKIE = 'db_primary'
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # Measures how long checkouts wait for a free connection (or for a new one to be opened).
+    # The engine name lives on the class because engine.dispose() builds a fresh pool instance.
+    engine_name = 'primary'
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_WAIT.labels(self.engine_name).observe(time.perf_counter() - started)
+
+
+def _pool_class(name: str):
+    return type(f'{name.title()}QueuePool', (TimedQueuePool,), {'engine_name': name})
+
+
+# Gauge updaters of the tracked pools, see report_pools
+_pool_reporters = []
+
+
+def _track_pool(engine, name: str):
+    sync_engine = engine.sync_engine
+
+    def update(*args):
+        # The size is set here as well: under gunicorn the master preloads the app and its samples
+        # are dropped, each forked worker has to report its own
+        POOL_SIZE.labels(name).set(sync_engine.pool.size())
+        POOL_CHECKED_OUT.labels(name).set(sync_engine.pool.checkedout())
+        POOL_OVERFLOW.labels(name).set(max(sync_engine.pool.overflow(), 0))
+
+    # Listening on the engine keeps the gauges fed after dispose() replaces the pool
+    for event_name in ('checkout', 'checkin', 'close', 'invalidate'):
+        event.listen(sync_engine, event_name, update)
+    _pool_reporters.append(update)
+    update()
+
+
+def report_pools():
+    # Called by gunicorn's post_fork, so a new worker reports its pools before its first query
+    for update in _pool_reporters:
+        update()
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def make_engine(url: str, name: str = 'primary'):
+    if DB_PGBOUNCER:
+        url = make_url(url).update_query_dict({'prepared_statement_cache_size': '0'})
+        engine = create_async_engine(url, poolclass=NullPool, connect_args={
+            'statement_cache_size': 0,
+            # Unique names, a statement prepared on one server connection may meet another one
+            'prepared_statement_name_func': lambda: f'__asyncpg_{uuid.uuid4()}__',
+        })
+        # Nothing to track, every session opens and closes its own connection
+        return engine
+
+    engine = create_async_engine(
+        url,
+        poolclass=_pool_class(name),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+
+    _track_pool(engine, name)
+    return engine
+
+
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
+read_engine = make_engine(SQLALCHEMY_READ_DATABASE_URL, 'replica') if SQLALCHEMY_READ_DATABASE_URL else None
+
+SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+ReadSessionLocal = async_sessionmaker(bind=read_engine, class_=AsyncSession, autoflush=False,
+                                      expire_on_commit=False, info={'replica': True}) if read_engine else None
 
 Base = declarative_base()
 
 
-def test_db_connection():
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
+
+
+def get_read_sessionmaker(request: Request):
+    # Read-only endpoints use the replica, unless this client wrote something a moment ago
+    if ReadSessionLocal is None or STICKY_PRIMARY_COOKIE in request.cookies:
+        return SessionLocal
+    return ReadSessionLocal
+
+
+async def get_read_db(request: Request):
+    async with get_read_sessionmaker(request)() as db:
+        yield db
+
+
+def is_replica(db: AsyncSession) -> bool:
+    return db.info.get('replica', False)
+
+
+class StickyPrimaryMiddleware:
+    # Marks clients that sent a write, so that get_read_db keeps them on the primary for
+    # READ_YOUR_WRITES_WINDOW seconds
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if read_engine is None or scope['type'] != 'http' or scope['method'] in ('GET', 'HEAD', 'OPTIONS'):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message):
+            if message['type'] == 'http.response.start':
+                MutableHeaders(scope=message).append(
+                    'set-cookie',
+                    f'{STICKY_PRIMARY_COOKIE}=1; Max-Age={READ_YOUR_WRITES_WINDOW}; Path=/; HttpOnly; SameSite=lax'
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
+
+
+async def create_tables():
+    # Every gunicorn worker runs this on startup. The transaction lock lets one of them create the
+    # schema while the others wait, they then find the tables there instead of racing on CREATE.
+    async with engine.begin() as connection:
+        await connection.execute(text('SELECT pg_advisory_xact_lock(CAST(:key AS BIGINT))'), {'key': SCHEMA_LOCK_KEY})
+        await connection.run_sync(Base.metadata.create_all)
+
+
+async def test_db_connection():
     try:
-        db = SessionLocal()
-        db.execute(text('SELECT 1'))
+        async with SessionLocal() as db:
+            await db.execute(text('SELECT 1'))
         logger.info("Database connection successfully established.")
     except Exception as e:
         logger.error(f"Database connection failed: {str(e)}")
-    finally:
-        db.close()
-
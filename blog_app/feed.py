@@ -0,0 +1,161 @@
+import hashlib
+import os
+from typing import Optional
+
+from sqlalchemy import select, func, tuple_, literal
+from sqlalchemy.dialects.postgresql import REAL
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload
+
+from . import database, timeline
+from .database import is_replica
+from .models import Tweets, Users, SEARCH_CONFIG
+
+# Part of every feed ETag, set it to something new on each deploy so template changes are not
+# answered with 304
+FEED_ETAG_RELEASE = os.getenv('FEED_ETAG_RELEASE', '')
+
+# Pages depend on the viewer, so only the browser may keep them and it has to revalidate
+FEED_CACHE_CONTROL = 'private, no-cache'
+
+
+def feed_query():
+    # Author, image and, for retweets, the original tweet with its author and image are joined
+    # in, so rendering a page is a single round trip instead of lazy loads per row.
+    original = joinedload(Tweets.original)
+    return select(Tweets).options(
+        joinedload(Tweets.user).joinedload(Users.avatar),
+        joinedload(Tweets.image),
+        original.joinedload(Tweets.user).joinedload(Users.avatar),
+        original.joinedload(Tweets.image),
+    )
+
+
+async def paginate_tweets(db: AsyncSession, query, before: Optional[int], limit: int):
+    # Keyset pagination on Tweets.id: one extra row tells us whether an older page exists,
+    # so the cost of a page does not depend on how deep into the feed it is.
+    if before is not None:
+        query = query.where(Tweets.id < before)
+
+    result = await db.scalars(query.order_by(Tweets.id.desc()).limit(limit + 1))
+    tweets = result.all()
+
+    next_before = tweets[limit - 1].id if len(tweets) > limit else None
+    return tweets[:limit], next_before
+
+
+async def stream_page(db: AsyncSession, query, before: Optional[int], limit: int, chunk_size: int, page: dict):
+    # Same page as paginate_tweets, yielded as lists of at most chunk_size payloads. Rows come from
+    # a server side cursor, so only one chunk of ORM objects is alive at a time. page['next_before']
+    # is known once the last chunk has been yielded.
+    if before is not None:
+        query = query.where(Tweets.id < before)
+
+    result = await db.stream_scalars(
+        query.order_by(Tweets.id.desc()).limit(limit + 1).execution_options(yield_per=chunk_size)
+    )
+    seen, last_id = 0, None
+    async for tweets in result.partitions():
+        kept = tweets[:limit - seen]
+        if len(kept) < len(tweets):
+            page['next_before'] = kept[-1].id if kept else last_id
+        if kept:
+            seen += len(kept)
+            last_id = kept[-1].id
+            yield [tweet.to_dict() for tweet in kept]
+
+
+async def load_tweet(db: AsyncSession, tweet_id: int):
+    return await db.scalar(feed_query().where(Tweets.id == tweet_id))
+
+
+def _payload_ttl(db: AsyncSession):
+    return timeline.REPLICA_PAYLOAD_TTL if is_replica(db) else None
+
+
+async def warm_timeline(db: AsyncSession, key: str, query, merge: bool = True):
+    result = await db.scalars(query.order_by(Tweets.id.desc()).limit(timeline.TIMELINE_MAX_LENGTH))
+    payloads = [tweet.to_dict() for tweet in result.all()]
+    await timeline.replace_timeline(key, payloads, complete=len(payloads) < timeline.TIMELINE_MAX_LENGTH,
+                                    merge=merge, payload_ttl=_payload_ttl(db))
+
+
+async def hydrate(db: AsyncSession, ids):
+    # One MGET for the cached payloads, one IN query for whatever has expired or was never cached
+    payloads = await timeline.get_payloads(ids)
+
+    missing = [tweet_id for tweet_id, payload in zip(ids, payloads) if payload is None]
+    if missing:
+        result = await db.scalars(feed_query().where(Tweets.id.in_(missing)))
+        loaded = {tweet.id: tweet.to_dict() for tweet in result.all()}
+        await timeline.store_payloads(list(loaded.values()), _payload_ttl(db))
+        payloads = [payload or loaded.get(tweet_id) for tweet_id, payload in zip(ids, payloads)]
+
+    return [payload for payload in payloads if payload is not None]
+
+
+async def read_page(db: AsyncSession, key: str, query, before: Optional[int], limit: int):
+    ids = await timeline.read_ids(key, before, limit)
+    if ids is timeline.COLD:
+        if is_replica(db):
+            # A lagging replica would bring deleted tweets back into the timeline and mark it
+            # complete, so the sorted set is only ever built from the primary
+            async with database.SessionLocal() as primary:
+                await warm_timeline(primary, key, query)
+        else:
+            await warm_timeline(db, key, query)
+        ids = await timeline.read_ids(key, before, limit)
+
+    if ids is None or ids is timeline.COLD:
+        tweets, next_before = await paginate_tweets(db, query, before, limit)
+        return [tweet.to_dict() for tweet in tweets], next_before
+
+    next_before = ids[limit - 1] if len(ids) > limit else None
+    return await hydrate(db, ids[:limit]), next_before
+
+
+async def search_tweets(db: AsyncSession, q: str, rank: Optional[float], before: Optional[int], limit: int):
+    # Matches come from the GIN index on search_vector and are ordered by ts_rank. The cursor is
+    # the (rank, id) of the last result shown, so a page never re-ranks the previous ones.
+    # Retweets have an empty vector and never match, the original shows up instead.
+    ts_query = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+    score = func.ts_rank(Tweets.search_vector, ts_query, type_=REAL)
+
+    query = feed_query().add_columns(score).where(Tweets.search_vector.bool_op('@@')(ts_query))
+    if rank is not None and before is not None:
+        query = query.where(tuple_(score, Tweets.id) < tuple_(literal(rank, REAL), literal(before)))
+
+    result = await db.execute(query.order_by(score.desc(), Tweets.id.desc()).limit(limit + 1))
+    rows = result.all()
+
+    next_cursor = (rows[limit - 1][1], rows[limit - 1][0].id) if len(rows) > limit else (None, None)
+    return [tweet.to_dict() for tweet, _ in rows[:limit]], next_cursor
+
+
+async def feed_etag(key: str, user_id, before: Optional[int], limit: int) -> Optional[str]:
+    # A weak validator for a rendered feed page: same newest tweet, no change anywhere since,
+    # same viewer and same page. Computed from Redis only, so a 304 costs no SQL and no rendering.
+    state = await timeline.feed_state(key, user_id)
+    if state is None:
+        return None
+
+    newest, changes, viewer_changes = state
+    parts = f'{FEED_ETAG_RELEASE}:{timeline.PAYLOAD_VERSION}:{key}:{newest}:{changes}:{user_id}:{viewer_changes}:{before}:{limit}'
+    return f'W/"{hashlib.sha1(parts.encode()).hexdigest()}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: Optional[str]) -> bool:
+    # Weak comparison as If-None-Match requires, the W/ prefix is ignored on both sides
+    if not if_none_match or etag is None:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    tags = {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+    return etag.removeprefix('W/') in tags
+
+
+def cache_headers(etag: Optional[str]) -> dict:
+    headers = {'Cache-Control': FEED_CACHE_CONTROL, 'Vary': 'Cookie'}
+    if etag is not None:
+        headers['ETag'] = etag
+    return headers
@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+
+from fastapi.templating import Jinja2Templates
+from markupsafe import Markup
+from redis.exceptions import RedisError
+
+from .cache import redis_client
+from .images import image_sources, image_url
+
+logger = logging.getLogger(__name__)
+
+FRAGMENT_CACHE_SIZE = int(os.getenv('FRAGMENT_CACHE_SIZE', 5000))
+FRAGMENT_REDIS_ENABLED = os.getenv('FRAGMENT_REDIS_ENABLED', 'false').lower() == 'true'
+FRAGMENT_TTL = int(os.getenv('FRAGMENT_TTL', 24 * 3600))
+
+# Cached cards keep these markers where the viewer-specific buttons go
+LIKE_BUTTON = '<!--like-button-->'
+VIEWER_ACTIONS = '<!--viewer-actions-->'
+
+templates = Jinja2Templates(directory="./blog_app/templates")
+templates.env.globals['image_sources'] = image_sources
+templates.env.globals['image_url'] = image_url
+
+card_template = templates.get_template("tweet_card.html")
+actions_template = templates.get_template("tweet_actions.html")
+
+# Changing the card markup must not serve cards rendered by the previous deploy from Redis
+with open(card_template.filename, 'rb') as f:
+    TEMPLATE_VERSION = hashlib.sha1(f.read()).hexdigest()[:8]
+
+
+class FragmentCache:
+    # In-process LRU of tweet id -> (version, html). Only the newest version of a card is kept;
+    # a lookup with any other version is a miss, so workers that never saw an invalidation
+    # event still re-render once the row's version moves on.
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    def get(self, tweet_id: int, version: int):
+        entry = self._entries.get(tweet_id)
+        if entry is None or entry[0] != version:
+            return None
+        self._entries.move_to_end(tweet_id)
+        return entry[1]
+
+    def set(self, tweet_id: int, version: int, html: str):
+        self._entries[tweet_id] = (version, html)
+        self._entries.move_to_end(tweet_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def discard(self, tweet_id: int):
+        self._entries.pop(tweet_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+local_cache = FragmentCache(FRAGMENT_CACHE_SIZE)
+
+
+def _redis_key(tweet_id: int, version: int) -> str:
+    return f'fragment:{TEMPLATE_VERSION}:{tweet_id}:{version}'
+
+
+async def _redis_get(tweets):
+    if not FRAGMENT_REDIS_ENABLED or not tweets:
+        return [None] * len(tweets)
+
+    try:
+        return await redis_client.mget([_redis_key(tweet['id'], tweet.get('version')) for tweet in tweets])
+    except RedisError as e:
+        logger.warning(f"Fragment multi-get failed: {e}")
+        return [None] * len(tweets)
+
+
+async def _redis_set(rendered):
+    if not FRAGMENT_REDIS_ENABLED or not rendered:
+        return
+
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for tweet, html in rendered:
+            pipe.set(_redis_key(tweet['id'], tweet.get('version')), html, ex=FRAGMENT_TTL)
+        await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Storing fragments failed: {e}")
+
+
+def render_card(tweet: dict) -> str:
+    return card_template.render(tweet=tweet, like_button=Markup(LIKE_BUTTON), viewer_actions=Markup(VIEWER_ACTIONS))
+
+
+def render_like(tweet: dict, liked: bool) -> str:
+    return str(actions_template.module.like_button(tweet, liked))
+
+
+def render_actions(tweet: dict, user: dict) -> str:
+    if tweet['owner_id'] != user.get('id'):
+        return ''
+    return str(actions_template.module.edit_button(tweet, user))
+
+
+def _splice(card: str, tweet: dict, user: dict, liked_ids) -> Markup:
+    card = card.replace(LIKE_BUTTON, render_like(tweet, (tweet.get('original_id') or tweet['id']) in liked_ids))
+    return Markup(card.replace(VIEWER_ACTIONS, render_actions(tweet, user)))
+
+
+async def render_cards(tweets, user: dict, liked_ids=frozenset()):
+    # Cards come from the local LRU, then from Redis in one MGET, and are only rendered on a miss.
+    # The like and edit buttons depend on who is looking (and likes change far more often than
+    # the tweet), so they are spliced in after the lookup.
+    cards = [local_cache.get(tweet['id'], tweet.get('version')) for tweet in tweets]
+
+    misses = [i for i, card in enumerate(cards) if card is None]
+    remote = await _redis_get([tweets[i] for i in misses])
+
+    rendered = []
+    for i, html in zip(misses, remote):
+        tweet = tweets[i]
+        if html is None:
+            html = render_card(tweet)
+            rendered.append((tweet, html))
+        local_cache.set(tweet['id'], tweet.get('version'), html)
+        cards[i] = html
+
+    await _redis_set(rendered)
+
+    return [_splice(card, tweet, user, liked_ids) for tweet, card in zip(tweets, cards)]
+
+
+def invalidate(ids):
+    # Versioned keys keep other workers and the Redis tier correct; this just frees the
+    # local entries right away instead of waiting for them to age out of the LRU.
+    for tweet_id in ids:
+        local_cache.discard(tweet_id)
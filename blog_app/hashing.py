@@ -0,0 +1,97 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from passlib.context import CryptContext
+from prometheus_client import Histogram
+
+logger = logging.getLogger(__name__)
+
+# "thread" is enough when bcrypt releases the GIL; "process" isolates hashing completely
+PASSWORD_HASH_EXECUTOR = os.getenv('PASSWORD_HASH_EXECUTOR', 'thread')
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv('PASSWORD_HASH_MAX_QUEUE', 32))
+
+bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+
+HASH_LATENCY = Histogram(
+    'password_hash_seconds', 'Time spent hashing or verifying a password', ['operation'],
+    buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1, 2, 5),
+)
+HASH_QUEUE_WAIT = Histogram(
+    'password_hash_queue_wait_seconds', 'Time a password job waited for a free worker', ['operation'],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+
+class PasswordHashQueueFull(Exception):
+    pass
+
+
+_executor = None
+_in_flight = 0
+
+
+def get_password_hash(password):
+    return bcrypt_context.hash(password)
+
+
+def verify_password(plain_password, hashed_password):
+    return bcrypt_context.verify(plain_password, hashed_password)
+
+
+def _timed(func, *args):
+    # time.monotonic is system wide on Linux, so the start time is comparable across processes
+    started = time.monotonic()
+    result = func(*args)
+    return result, started, time.monotonic() - started
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        if PASSWORD_HASH_EXECUTOR == 'process':
+            _executor = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        else:
+            _executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix='bcrypt')
+    return _executor
+
+
+async def _run(operation: str, func, *args):
+    # Only touched from the event loop thread, so the counter needs no lock
+    global _in_flight
+    if _in_flight >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE:
+        logger.warning(f"Password hash queue is full, rejecting {operation}")
+        raise PasswordHashQueueFull()
+
+    _in_flight += 1
+    submitted = time.monotonic()
+    try:
+        result, started, duration = await asyncio.get_running_loop().run_in_executor(
+            _get_executor(), _timed, func, *args
+        )
+    finally:
+        _in_flight -= 1
+
+    HASH_QUEUE_WAIT.labels(operation).observe(max(started - submitted, 0))
+    HASH_LATENCY.labels(operation).observe(duration)
+    return result
+
+
+async def hash_password(password):
+    return await _run('hash', get_password_hash, password)
+
+
+async def check_password(plain_password, hashed_password):
+    return await _run('verify', verify_password, plain_password, hashed_password)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
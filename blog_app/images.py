@@ -0,0 +1,106 @@
+import argparse
+import logging
+import os
+from pathlib import Path
+
+from PIL import Image
+
+try:
+    import pillow_avif  # noqa: F401 - registers the AVIF plugin with Pillow when installed
+except ImportError:
+    pass
+
+logger = logging.getLogger(__name__)
+
+IMAGE_ROOT = "./blog_app/static/images/"
+IMAGE_URL_ROOT = "/static/images/"
+
+# Widths are chosen for the feed layout: avatars are drawn at 40px, tweet images at up to 300px
+# (full width on phones), so each list covers 1x to 2x+ density screens.
+VARIANT_WIDTHS = {
+    'avas': (48, 96, 200),
+    'tweets': (320, 640, 800),
+}
+SIZES = {
+    'avas': '40px',
+    'tweets': '(max-width: 576px) 100vw, 300px',
+}
+
+Image.init()
+AVIF_ENABLED = os.getenv('IMAGE_AVIF_ENABLED', 'true').lower() == 'true' and 'AVIF' in Image.SAVE
+
+# Most efficient format first, browsers take the first <source> they support
+VARIANT_FORMATS = [fmt for fmt, enabled in (('avif', AVIF_ENABLED), ('webp', True)) if enabled]
+MIME_TYPES = {'avif': 'image/avif', 'webp': 'image/webp'}
+SAVE_OPTIONS = {
+    'avif': {'format': 'AVIF', 'quality': 60},
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+}
+
+
+def variant_name(stem: str, width: int, fmt: str) -> str:
+    return f"{stem}_{width}.{fmt}"
+
+
+def image_url(kind: str, stem) -> str:
+    return f"{IMAGE_URL_ROOT}{kind}/{stem}.png"
+
+
+def image_sources(kind: str, stem):
+    # <source> attributes for a <picture> element, the PNG from image_url stays as the fallback
+    return [
+        {
+            'type': MIME_TYPES[fmt],
+            'srcset': ', '.join(f"{IMAGE_URL_ROOT}{kind}/{variant_name(stem, width, fmt)} {width}w"
+                                for width in VARIANT_WIDTHS[kind]),
+            'sizes': SIZES[kind],
+        }
+        for fmt in VARIANT_FORMATS
+    ]
+
+
+def write_variants(image: Image.Image, image_path: Path, kind: str):
+    # Writes every width/format combination next to image_path, from an already decoded image
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+
+    for width in VARIANT_WIDTHS[kind]:
+        if image.width > width:
+            variant = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+        else:
+            variant = image
+
+        for fmt in VARIANT_FORMATS:
+            target = image_path.with_name(variant_name(image_path.stem, width, fmt))
+            tmp_path = target.with_name(f".{target.name}.tmp")
+            variant.save(tmp_path, **SAVE_OPTIONS[fmt])
+            os.replace(tmp_path, target)
+
+
+def backfill(kinds):
+    # Generates variants for images that were processed before variants existed
+    for kind in kinds:
+        for image_path in sorted(Path(IMAGE_ROOT, kind).glob('*.png')):
+            if image_path.stem == 'twitter':
+                continue
+            try:
+                with Image.open(image_path) as image:
+                    image.load()
+                    write_variants(image, image_path.resolve(), kind)
+                logger.info(f"Wrote variants for {image_path}")
+            except Exception as e:
+                logger.error(f"Failed to write variants for {image_path}: {str(e)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate responsive variants for already stored images")
+    parser.add_argument('--kind', choices=sorted(VARIANT_WIDTHS), action='append', dest='kinds',
+                        help="only process this image directory (can be repeated)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    backfill(args.kinds or sorted(VARIANT_WIDTHS))
+
+
+if __name__ == '__main__':
+    main()
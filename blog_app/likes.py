@@ -0,0 +1,158 @@
+import logging
+import os
+import uuid
+
+from redis.exceptions import RedisError, ResponseError
+from sqlalchemy import select, text, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import fragments, timeline
+from .cache import redis_client
+from .models import Likes, Tweets
+
+logger = logging.getLogger(__name__)
+
+LIKE_FLUSH_INTERVAL = float(os.getenv('LIKE_FLUSH_INTERVAL', 10))
+LIKE_FLUSH_BATCH_SIZE = int(os.getenv('LIKE_FLUSH_BATCH_SIZE', 500))
+# Far longer than a flush takes; a worker that dies holding the lock only blocks flushes this long
+LIKE_FLUSH_LOCK_TTL = int(os.getenv('LIKE_FLUSH_LOCK_TTL', 300))
+# How long the names of applied hashes are remembered, see CLAIM_FLUSH
+LIKE_FLUSH_RETENTION = int(os.getenv('LIKE_FLUSH_RETENTION', 7 * 24 * 3600))
+
+# Hash of tweet id -> like count delta that has not reached tweets.like_count yet
+PENDING_LIKES = 'likes:pending'
+# A flush renames the pending hash to a key with this prefix, so new likes start a fresh hash
+FLUSHING_PREFIX = 'likes:flushing:'
+FLUSH_LOCK = 'likes:flush-lock'
+
+# Removes the like if it exists and inserts it otherwise, in a single statement. Both parts see
+# the same snapshot, so the INSERT is skipped exactly when the DELETE found a row; ON CONFLICT
+# covers a concurrent toggle that inserted the same like first. The result is the change in the
+# tweet's like count: 1, -1, or 0 when the concurrent toggle won.
+TOGGLE_LIKE = text("""
+    WITH removed AS (
+        DELETE FROM likes WHERE user_id = :user_id AND tweet_id = :tweet_id
+        RETURNING tweet_id
+    ), added AS (
+        INSERT INTO likes (user_id, tweet_id)
+        SELECT CAST(:user_id AS integer), CAST(:tweet_id AS integer)
+        WHERE NOT EXISTS (SELECT 1 FROM removed)
+        ON CONFLICT DO NOTHING
+        RETURNING tweet_id
+    )
+    SELECT (SELECT count(*) FROM added) - (SELECT count(*) FROM removed)
+""")
+
+APPLY_DELTAS = text("""
+    UPDATE tweets SET like_count = GREATEST(tweets.like_count + d.delta, 0)
+    FROM unnest(CAST(:ids AS integer[]), CAST(:deltas AS integer[])) AS d(id, delta)
+    WHERE tweets.id = d.id
+""")
+
+# Returns nothing when the hash was applied before
+CLAIM_FLUSH = text("INSERT INTO like_flushes (key) VALUES (:key) ON CONFLICT DO NOTHING RETURNING key")
+PRUNE_FLUSHES = text(
+    "DELETE FROM like_flushes WHERE flushed_at < now() - CAST(:seconds AS integer) * interval '1 second'"
+)
+
+RETWEETS_OF = text("SELECT id FROM tweets WHERE original_id = ANY(CAST(:ids AS integer[]))")
+
+
+async def toggle_like(db: AsyncSession, user_id: int, tweet_id: int) -> int:
+    # Returns the like count delta, the tweet is liked by the user afterwards unless it is -1
+    delta = await db.scalar(TOGGLE_LIKE, {'user_id': user_id, 'tweet_id': tweet_id})
+    await db.commit()
+    return delta
+
+
+async def record_like(db: AsyncSession, tweet_id: int, delta: int):
+    if delta == 0:
+        return
+
+    # Popular tweets would serialize every like on their row lock, so the count is kept in Redis
+    # and written in batches by the flush task. Without Redis the row is updated directly.
+    try:
+        await redis_client.hincrby(PENDING_LIKES, str(tweet_id), delta)
+    except RedisError as e:
+        logger.warning(f"Buffering like for tweet {tweet_id} failed, updating the row: {e}")
+        await db.execute(
+            update(Tweets).where(Tweets.id == tweet_id)
+            .values(like_count=Tweets.like_count + delta)
+        )
+        await db.commit()
+
+
+async def liked_tweet_ids(db: AsyncSession, user_id: int, tweet_ids) -> set:
+    # One query per page for the viewer's own likes; the rest of the card is shared by everyone
+    if not tweet_ids or user_id is None:
+        return set()
+
+    result = await db.scalars(
+        select(Likes.tweet_id).where(Likes.user_id == user_id, Likes.tweet_id.in_(tweet_ids))
+    )
+    return set(result.all())
+
+
+async def flush_like_counts(db: AsyncSession, redis) -> int:
+    # Runs on one worker at a time. A beat tick that overlaps a slow flush returns right away,
+    # it would otherwise pick up the hash the running flush is still applying.
+    token = uuid.uuid4().hex
+    if not await redis.set(FLUSH_LOCK, token, nx=True, ex=LIKE_FLUSH_LOCK_TTL):
+        logger.info("Another like count flush is running, skipping this one")
+        return 0
+
+    try:
+        return await _flush_like_counts(db, redis)
+    finally:
+        # The lock may have expired during a very slow flush and been taken by the next one
+        if await redis.get(FLUSH_LOCK) == token:
+            await redis.delete(FLUSH_LOCK)
+
+
+async def _flush_like_counts(db: AsyncSession, redis) -> int:
+    # Moves the pending deltas into tweets.like_count. Hashes left behind by a flush that failed
+    # half way are picked up first; a hash is only deleted once its batch is committed.
+    keys = [key async for key in redis.scan_iter(match=f'{FLUSHING_PREFIX}*')]
+
+    flushing = f'{FLUSHING_PREFIX}{uuid.uuid4().hex}'
+    try:
+        await redis.rename(PENDING_LIKES, flushing)
+        keys.append(flushing)
+    except ResponseError:
+        # Nothing was liked since the last flush
+        pass
+
+    flushed = 0
+    for key in keys:
+        deltas = [(int(tweet_id), int(delta)) for tweet_id, delta in (await redis.hgetall(key)).items()
+                  if int(delta) != 0]
+
+        # The hash's name is committed together with its deltas. One that is already recorded was
+        # applied by a flush that died before deleting it, so it is only deleted now.
+        if await db.scalar(CLAIM_FLUSH, {'key': key}) is None:
+            await db.rollback()
+            logger.warning(f"Like counts in {key} were already applied, dropping the hash")
+            await redis.delete(key)
+            continue
+
+        for start in range(0, len(deltas), LIKE_FLUSH_BATCH_SIZE):
+            batch = deltas[start:start + LIKE_FLUSH_BATCH_SIZE]
+            await db.execute(APPLY_DELTAS, {'ids': [tweet_id for tweet_id, _ in batch],
+                                            'deltas': [delta for _, delta in batch]})
+        await db.commit()
+        await redis.delete(key)
+
+        # Cached payloads carry like_count, the next read loads the new value. Retweets are
+        # cached under their own id with a copy of the original's count.
+        ids = [tweet_id for tweet_id, _ in deltas]
+        if ids:
+            ids += (await db.scalars(RETWEETS_OF, {'ids': ids})).all()
+        await timeline.forget_tweets(ids, client=redis)
+        fragments.invalidate(ids)
+        flushed += len(deltas)
+
+    if keys:
+        await db.execute(PRUNE_FLUSHES, {'seconds': LIKE_FLUSH_RETENTION})
+        await db.commit()
+
+    return flushed
@@ -1,9 +1,13 @@
-from fastapi import FastAPI
-from .models import Base
-from .database import engine, test_db_connection
-from .routers import auth, tweets, users
-from fastapi.staticfiles import StaticFiles
-from starlette.responses import RedirectResponse
+from fastapi import FastAPI, Request
+from . import models  # noqa: F401 - registers the tables on Base.metadata
+from .database import create_tables, test_db_connection, StickyPrimaryMiddleware
+from .hashing import PasswordHashQueueFull, shutdown as shutdown_password_hashing
+from .metrics import PrometheusMiddleware, metrics_endpoint
+from .compression import CompressionMiddleware, COMPRESSION_ENABLED
+from . import profiler
+from .routers import api, auth, tweets, users
+from .static_files import CachedStaticFiles, STATIC_ROOT
+from starlette.responses import RedirectResponse, PlainTextResponse
 from starlette import status
 import sentry_sdk
 import logging
@@ -16,13 +20,32 @@ sentry_sdk.init(
 
 app = FastAPI()
 
-Base.metadata.create_all(bind=engine)
+app.add_middleware(StickyPrimaryMiddleware)
+app.add_middleware(PrometheusMiddleware)
 
-app.mount("/static", StaticFiles(directory="./blog_app/static"), name="static")
+if profiler.SQL_PROFILER_ENABLED:
+    app.add_middleware(profiler.SQLProfilerMiddleware)
+
+# Outermost, so every other middleware sees (and adds headers to) the uncompressed response
+if COMPRESSION_ENABLED:
+    app.add_middleware(CompressionMiddleware)
+
+app.mount("/static", CachedStaticFiles(directory=STATIC_ROOT), name="static")
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
 
 @app.on_event("startup")
 async def startup_event():
-    test_db_connection()
+    await test_db_connection()
+    await create_tables()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    shutdown_password_hashing()
+
+@app.exception_handler(PasswordHashQueueFull)
+async def password_hash_queue_full_handler(request: Request, exc: PasswordHashQueueFull):
+    return PlainTextResponse("Server is busy, please retry shortly", status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                             headers={"Retry-After": "1"})
 
 @app.get("/")
 async def root():
@@ -36,3 +59,4 @@ logging.basicConfig(
 app.include_router(auth.router)
 app.include_router(tweets.router)
 app.include_router(users.router)
+app.include_router(api.router)
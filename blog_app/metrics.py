@@ -0,0 +1,103 @@
+import os
+import time
+
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST,
+                               generate_latest, multiprocess)
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Mount
+
+from .sql_timing import recording
+
+# Set by the process manager before any worker starts; every process then writes its samples
+# to files in this directory and /metrics sums them up
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+UNMATCHED_ROUTE = '<unmatched>'
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests by route template and status code',
+                   ['method', 'route', 'status'])
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time to produce a response, by route template', ['method', 'route'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS_IN_PROGRESS = Gauge('http_requests_in_progress', 'Requests being handled right now', ['method'],
+                             multiprocess_mode='livesum')
+REQUEST_QUERIES = Histogram(
+    'db_queries_per_request', 'SQL statements executed while handling a request', ['route'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250),
+)
+REQUEST_DB_TIME = Histogram(
+    'db_time_per_request_seconds', 'Time spent in SQL statements while handling a request', ['route'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+
+
+class QueryStats:
+    __slots__ = ('count', 'duration')
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def add(self, statement: str, parameters, duration: float):
+        self.count += 1
+        self.duration += duration
+
+
+def route_template(scope) -> str:
+    # The router leaves the matched route in the scope; labelling by its template instead of the
+    # raw path keeps one time series per endpoint rather than one per tweet or user id
+    route = scope.get('route')
+    if route is not None:
+        return route.path
+
+    app = scope.get('app')
+    for mount in getattr(app, 'routes', ()):
+        if isinstance(mount, Mount) and scope['path'].startswith(mount.path + '/'):
+            return f'{mount.path}/{{path}}'
+    return UNMATCHED_ROUTE
+
+
+class PrometheusMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] == '/metrics':
+            await self.app(scope, receive, send)
+            return
+
+        method = scope['method']
+        status_code = 500
+        stats = QueryStats()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        REQUESTS_IN_PROGRESS.labels(method).inc()
+        started = time.perf_counter()
+        try:
+            with recording(stats):
+                await self.app(scope, receive, send_with_status)
+        finally:
+            duration = time.perf_counter() - started
+            REQUESTS_IN_PROGRESS.labels(method).dec()
+
+            route = route_template(scope)
+            REQUESTS.labels(method, route, str(status_code)).inc()
+            REQUEST_LATENCY.labels(method, route).observe(duration)
+            REQUEST_QUERIES.labels(route).observe(stats.count)
+            REQUEST_DB_TIME.labels(route).observe(stats.duration)
+
+
+def metrics_endpoint(request: Request):
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
@@ -1,8 +1,29 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import (Column, Integer, String, Boolean, DateTime, ForeignKey, Index, UniqueConstraint, Computed,
+                        func)
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import relationship, deferred
 from sqlalchemy.ext.hybrid import hybrid_property
 from .database import Base
 
+# Text search configuration of Tweets.search_vector; queries have to use the same one
+SEARCH_CONFIG = 'english'
+
+
+class Images(Base):
+    __tablename__ = 'images'
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)
+    digest = Column(String, nullable=True)
+    stem = Column(String, nullable=False)
+
+    # digest is the sha256 of the upload; images stored before content addressing have none
+    # and keep their old numeric file name as stem
+    __table_args__ = (
+        UniqueConstraint('kind', 'digest', name='uq_images_kind_digest'),
+    )
+
+
 class Users(Base):
     __tablename__ = 'users'
 
@@ -16,8 +37,10 @@ class Users(Base):
     is_active = Column(Boolean, default=True)
     role = Column(String, default=None)
     phone_number = Column(String)
+    avatar_id = Column(Integer, ForeignKey("images.id"), nullable=True, default=None)
 
     tweets = relationship("Tweets", back_populates="user")
+    avatar = relationship("Images")
 
 
 class Tweets(Base):
@@ -25,15 +48,28 @@ class Tweets(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     new_tweet = Column(String)
-    liked = Column(Boolean, default=False)
     has_image = Column(Boolean, default=False)
-    image_id = Column(Integer, nullable=True, default=None)
+    image_id = Column(Integer, ForeignKey("images.id"), nullable=True, default=None)
     owner_id = Column(Integer, ForeignKey("users.id"))
-    retweeted = Column(Boolean, default=False)
-    op_id = Column(Integer, nullable=True, default=None)
-    op_username = Column(String, nullable=True, default=None)
+    # A retweet only points at the tweet it shares; text and image are read from the original
+    original_id = Column(Integer, ForeignKey("tweets.id", ondelete="CASCADE"), nullable=True, default=None,
+                         index=True)
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    # Flushed from the Redis counters by the flush_like_counts task, so it lags a few seconds
+    like_count = Column(Integer, nullable=False, default=0, server_default='0')
+    # Maintained by Postgres on every write; deferred because only the search query needs it
+    search_vector = deferred(Column(
+        TSVECTOR, Computed(f"to_tsvector('{SEARCH_CONFIG}', coalesce(new_tweet, ''))", persisted=True)
+    ))
 
     user = relationship("Users", back_populates="tweets")
+    original = relationship("Tweets", remote_side=[id])
+    image = relationship("Images")
+
+    __table_args__ = (
+        Index('ix_tweets_owner_id_id', owner_id, id.desc()),
+        Index('ix_tweets_search_vector', 'search_vector', postgresql_using='gin'),
+    )
 
     @hybrid_property
     def has_pp(self):
@@ -42,3 +78,50 @@ class Tweets(Base):
     @hybrid_property
     def username(self):
         return self.user.username
+
+    @hybrid_property
+    def retweeted(self):
+        return self.original_id is not None
+
+    @retweeted.expression
+    def retweeted(cls):
+        return cls.original_id.is_not(None)
+
+    def to_dict(self):
+        # Flat view of a feed row, used for cached timeline payloads; expects user, image, their
+        # avatars and, for retweets, the original with its user and image loaded
+        source = self.original or self
+        return {
+            'id': self.id,
+            'original_id': self.original_id,
+            'new_tweet': source.new_tweet,
+            'has_image': source.has_image,
+            'image_id': source.image_id,
+            'owner_id': self.owner_id,
+            'retweeted': self.retweeted,
+            'op_id': source.owner_id if self.retweeted else None,
+            'op_username': source.user.username if self.retweeted else None,
+            'username': self.username,
+            'has_pp': self.has_pp,
+            'image': source.image.stem if source.image else None,
+            'avatar': self.user.avatar.stem if self.user.avatar else None,
+            'op_avatar': source.user.avatar.stem if self.retweeted and source.user.avatar else None,
+            'version': self.version,
+            'like_count': source.like_count,
+        }
+
+
+class Likes(Base):
+    __tablename__ = 'likes'
+
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    tweet_id = Column(Integer, ForeignKey("tweets.id", ondelete="CASCADE"), primary_key=True)
+
+
+class LikeFlushes(Base):
+    # Names of the Redis hashes whose deltas reached tweets.like_count, written in the same
+    # transaction, so a hash is never applied twice (see likes.flush_like_counts)
+    __tablename__ = 'like_flushes'
+
+    key = Column(String, primary_key=True)
+    flushed_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
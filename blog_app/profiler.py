@@ -0,0 +1,89 @@
+import logging
+import os
+import re
+from collections import Counter
+
+from starlette.datastructures import MutableHeaders
+
+from .sql_timing import recording
+
+logger = logging.getLogger(__name__)
+
+# Meant for development and staging, every statement of a request is kept in memory
+SQL_PROFILER_ENABLED = os.getenv('SQL_PROFILER_ENABLED', 'false').lower() == 'true'
+# A statement shape executed more often than this in one request is reported as a likely N+1
+SQL_REPEAT_THRESHOLD = int(os.getenv('SQL_REPEAT_THRESHOLD', 5))
+SQL_SLOW_QUERY_MS = float(os.getenv('SQL_SLOW_QUERY_MS', 100))
+
+PROFILE_HEADER = 'X-SQL-Profile'
+
+# asyncpg style $1 (optionally with a ::TYPE cast added by the dialect), pyformat and qmark
+_PLACEHOLDER = r'(?:\$\d+(?:::\w+(?:\[\])?)?|%\(\w+\)s|\?)'
+_PLACEHOLDER_LIST = re.compile(rf'{_PLACEHOLDER}(?:\s*,\s*{_PLACEHOLDER})*')
+_NUMBER = re.compile(r'\b\d+\b')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def statement_shape(statement: str) -> str:
+    # Queries that only differ in their parameters, or in how many values an IN list expanded
+    # to, share a shape
+    shape = _PLACEHOLDER_LIST.sub('?', statement)
+    shape = _NUMBER.sub('N', shape)
+    return _WHITESPACE.sub(' ', shape).strip()
+
+
+class RequestProfile:
+    def __init__(self):
+        self.statements = []
+
+    def add(self, statement: str, parameters, duration: float):
+        self.statements.append((statement, parameters, duration))
+        if duration * 1000 >= SQL_SLOW_QUERY_MS:
+            logger.warning(f"Slow query ({duration * 1000:.1f}ms): {statement} parameters={parameters!r}")
+
+    @property
+    def total_time(self) -> float:
+        return sum(duration for _, _, duration in self.statements)
+
+    def repeated_shapes(self, threshold: int = None):
+        threshold = SQL_REPEAT_THRESHOLD if threshold is None else threshold
+        counts = Counter(statement_shape(statement) for statement, _, _ in self.statements)
+        return [(shape, count) for shape, count in counts.most_common() if count > threshold]
+
+    def summary(self) -> str:
+        return (f"queries={len(self.statements)}; time={self.total_time * 1000:.1f}ms; "
+                f"repeated={len(self.repeated_shapes())}")
+
+
+class SQLProfilerMiddleware:
+    # Collects the statements of each request, reports the summary in a response header and
+    # logs statement shapes that ran more than SQL_REPEAT_THRESHOLD times
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile()
+
+        async def send_with_summary(message):
+            # Statements issued while a response is still streaming are only in the log
+            if message['type'] == 'http.response.start':
+                MutableHeaders(scope=message).append(PROFILE_HEADER, profile.summary())
+            await send(message)
+
+        try:
+            with recording(profile):
+                await self.app(scope, receive, send_with_summary)
+        finally:
+            self.report(scope, profile)
+
+    @staticmethod
+    def report(scope, profile: RequestProfile):
+        request_line = f"{scope['method']} {scope['path']}"
+        for shape, count in profile.repeated_shapes():
+            logger.warning(f"Possible N+1 in {request_line}: {count} x {shape}")
+
+        logger.debug(f"SQL profile for {request_line}: {profile.summary()}")
@@ -0,0 +1,155 @@
+import logging
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Query
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from ..database import get_db, get_read_db
+from ..feed import feed_query, load_tweet, read_page
+from ..images import image_url
+from ..models import Tweets
+from .. import timeline, likes
+from .auth import decode_access_token
+
+router = APIRouter(
+    prefix="/api/v1/tweets",
+    tags=["api"],
+    default_response_class=ORJSONResponse,
+)
+
+logger = logging.getLogger(__name__)
+
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+
+
+async def get_api_user(request: Request):
+    # Mobile clients send the token as a bearer header, the SPA rides on the login cookie.
+    # Unlike the HTML pages there is no login page to redirect to, so it is a plain 401.
+    scheme, _, token = request.headers.get('authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        token = request.cookies.get('access_token')
+
+    user = decode_access_token(token) if token else None
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return user
+
+
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
+api_user_dependency = Annotated[dict, Depends(get_api_user)]
+
+
+class TweetCreate(BaseModel):
+    text: str = Field(min_length=1, max_length=1000)
+
+
+def serialize_tweet(payload: dict, liked_ids) -> dict:
+    # Public shape of a tweet: the cached payload minus storage details, with URLs instead of stems
+    retweeted = payload['retweeted']
+    return {
+        'id': payload['id'],
+        'text': payload['new_tweet'],
+        'owner_id': payload['owner_id'],
+        'username': payload['username'],
+        'avatar_url': image_url('avas', payload['avatar']) if payload['avatar'] else None,
+        'image_url': image_url('tweets', payload['image']) if payload['image'] else None,
+        'like_count': payload['like_count'],
+        'liked': (payload['original_id'] or payload['id']) in liked_ids,
+        'retweet_of': {
+            'id': payload['original_id'],
+            'owner_id': payload['op_id'],
+            'username': payload['op_username'],
+            'avatar_url': image_url('avas', payload['op_avatar']) if payload['op_avatar'] else None,
+        } if retweeted else None,
+        'version': payload['version'],
+    }
+
+
+async def serialize_page(db: AsyncSession, user: dict, tweets, next_before: Optional[int]) -> dict:
+    liked_ids = await likes.liked_tweet_ids(db, user.get('id'), [tweet['original_id'] or tweet['id'] for tweet in tweets])
+    return {'tweets': [serialize_tweet(tweet, liked_ids) for tweet in tweets], 'next_before': next_before}
+
+
+async def serialize_one(db: AsyncSession, user: dict, tweet: Tweets) -> dict:
+    payload = tweet.to_dict()
+    liked_ids = await likes.liked_tweet_ids(db, user.get('id'), [payload['original_id'] or payload['id']])
+    return serialize_tweet(payload, liked_ids)
+
+
+@router.get("")
+async def read_feed(db: read_db_dependency, user: api_user_dependency,
+                    before: Optional[int] = Query(None, gt=0),
+                    limit: int = Query(API_PAGE_SIZE, ge=1, le=API_MAX_PAGE_SIZE)):
+    tweets, next_before = await read_page(db, timeline.GLOBAL_TIMELINE, feed_query(), before, limit)
+    return await serialize_page(db, user, tweets, next_before)
+
+
+@router.get("/users/{user_id}")
+async def read_user_timeline(user_id: int, db: read_db_dependency, user: api_user_dependency,
+                             before: Optional[int] = Query(None, gt=0),
+                             limit: int = Query(API_PAGE_SIZE, ge=1, le=API_MAX_PAGE_SIZE)):
+    tweets, next_before = await read_page(db, timeline.user_timeline(user_id),
+                                          feed_query().where(Tweets.owner_id == user_id), before, limit)
+    return await serialize_page(db, user, tweets, next_before)
+
+
+@router.get("/{tweet_id}")
+async def read_tweet(tweet_id: int, db: read_db_dependency, user: api_user_dependency):
+    tweet = await load_tweet(db, tweet_id)
+    if tweet is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tweet not found")
+    return await serialize_one(db, user, tweet)
+
+
+@router.post("", status_code=status.HTTP_201_CREATED)
+async def create_tweet(body: TweetCreate, db: db_dependency, user: api_user_dependency):
+    # Text only; image uploads stay on the multipart form of the HTML route
+    tweet = Tweets(new_tweet=body.text, owner_id=user.get('id'))
+    db.add(tweet)
+    await db.commit()
+
+    tweet = await load_tweet(db, tweet.id)
+    await timeline.push_tweet(tweet.to_dict())
+    return await serialize_one(db, user, tweet)
+
+
+@router.post("/{tweet_id}/like")
+async def like_tweet(tweet_id: int, db: db_dependency, user: api_user_dependency):
+    tweet = await db.get(Tweets, tweet_id)
+    if tweet is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tweet not found")
+
+    # Likes and like_count live on the original, liking a retweet likes the tweet it shares
+    liked_id = tweet.original_id or tweet.id
+    try:
+        delta = await likes.toggle_like(db, user.get('id'), liked_id)
+    except IntegrityError:
+        # Deleted between the lookup and the insert
+        await db.rollback()
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tweet not found")
+
+    await likes.record_like(db, liked_id, delta)
+    await timeline.touch_viewer(user.get('id'))
+    return {'liked': delta >= 0}
+
+
+@router.post("/{tweet_id}/retweet", status_code=status.HTTP_201_CREATED)
+async def retweet(tweet_id: int, db: db_dependency, user: api_user_dependency):
+    original = await db.get(Tweets, tweet_id)
+    if original is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tweet not found")
+
+    tweet = Tweets(owner_id=user.get('id'), original_id=original.original_id or original.id)
+    db.add(tweet)
+    await db.commit()
+
+    tweet = await load_tweet(db, tweet.id)
+    await timeline.push_tweet(tweet.to_dict())
+    return await serialize_one(db, user, tweet)
@@ -1,20 +1,24 @@
 from datetime import timedelta, datetime, timezone
-from io import BytesIO
 from typing import Annotated, Optional
 import logging
 import re
 
-from PIL import Image, UnidentifiedImageError
+from PIL import UnidentifiedImageError
 from fastapi import APIRouter, Depends, HTTPException, Request, Response, Form, UploadFile, File
+from sqlalchemy import select, update, or_
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
 from starlette import status
 from starlette.responses import RedirectResponse
 
-from ..database import SessionLocal
-from ..models import Users
-from ..tasks.tasks import compress_img
-from passlib.context import CryptContext
+from ..database import get_db, get_read_db
+from ..models import Users, Tweets
+from .. import timeline, fragments
+from ..token_cache import verified_tokens, TOKEN_CACHE_ENABLED
+from ..uploads import receive_image, store_image, UploadTooLarge
+from ..hashing import (bcrypt_context, get_password_hash, verify_password, hash_password, check_password,
+                       PasswordHashQueueFull)
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 from jose import jwt, JWTError
 
@@ -34,7 +38,6 @@ load_dotenv()
 SECRET_KEY = os.getenv('SECRET_KEY')
 ALGORITHM = 'HS256'
 
-bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl='auth/token')
 
 templates = Jinja2Templates(directory="./blog_app/templates")
@@ -53,29 +56,14 @@ class LoginForm:
         self.password = form.get("password")
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-db_dependency = Annotated[Session, Depends(get_db)]
-
-def get_password_hash(password):
-    return bcrypt_context.hash(password)
-
-
-def verify_password(plain_password, hashed_password):
-    return bcrypt_context.verify(plain_password, hashed_password)
-
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
 
-def authenticate_user(username: str, password: str, db):
-    user = db.query(Users).filter(Users.username == username).first()
+async def authenticate_user(username: str, password: str, db: AsyncSession):
+    user = await db.scalar(select(Users).where(Users.username == username))
     if not user:
         return False
-    if not bcrypt_context.verify(password, user.hashed_password):
+    if not await check_password(password, user.hashed_password):
         return False
     return user
 
@@ -101,59 +89,77 @@ def is_password_strong(password: str) -> bool:
     return True
 
 
-async def get_current_user(request: Request):
+def decode_access_token(token: str):
+    # The user dict for a valid token, None for anything else
     try:
-        token = request.cookies.get("access_token")
-        if token is None:
-            return None
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get('sub')
-        user_id: str = payload.get('id')
-        if username is None or user_id is None:
-            await logout(request)
-            return None
-        return {'username': username, 'id': user_id}
+        payload = verified_tokens.get(token) if TOKEN_CACHE_ENABLED else None
+        if payload is None:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except JWTError:
-        await logout(request)
         return None
+    username: str = payload.get('sub')
+    user_id: str = payload.get('id')
+    if username is None or user_id is None:
+        return None
+    if TOKEN_CACHE_ENABLED:
+        verified_tokens.set(token, payload)
+    return {'username': username, 'id': user_id}
+
+
+async def get_current_user(request: Request):
+    token = request.cookies.get("access_token")
+    if token is None:
+        return None
+    user = decode_access_token(token)
+    if user is None:
+        await logout(request)
+    return user
 
 async def get_authenticated_user(request: Request, user: dict = Depends(get_current_user)):
     if user is None:
         raise HTTPException(status_code=status.HTTP_302_FOUND, detail="Not authenticated", headers={"Location": "/auth"})
     return user
 
-async def profile_picture_upload(request: Request, user, file: UploadFile = File(None), db: Session = Depends(get_db)):
+async def profile_picture_upload(request: Request, user, file: UploadFile = File(None), db: AsyncSession = Depends(get_db)):
     if file and file.filename != "":
         try:
-            contents = await file.read()
-            image = Image.open(BytesIO(contents))
-
-            output = BytesIO()
-            image.save(output, format="PNG")
-            output.seek(0)
-
-            image_dir = "./blog_app/static/images/avas/"
-            if not os.path.exists(image_dir):
-                os.makedirs(image_dir)
-
-            file_path = os.path.join(image_dir, f"{user.id}.png")
-
-            with open(file_path, "wb") as f:
-                f.write(output.read())
-
-            compress_img.delay(file_path)
+            upload_path, digest = await receive_image(file)
+            image = await store_image(db, 'avas', upload_path, digest)
 
+            changed_picture = user.avatar_id != image.id
             user.has_pp = True
+            user.avatar_id = image.id
 
             db.add(user)
-            db.commit()
 
+            tweet_ids = []
+            if changed_picture:
+                # Cached payloads and cards of this user's tweets and retweets of them point at the old avatar
+                originals = aliased(Tweets)
+                result = await db.scalars(
+                    update(Tweets).where(or_(
+                        Tweets.owner_id == user.id,
+                        Tweets.original_id.in_(select(originals.id).where(originals.owner_id == user.id)),
+                    ))
+                    .values(version=Tweets.version + 1).returning(Tweets.id)
+                )
+                tweet_ids = result.all()
+
+            await db.commit()
+
+            await timeline.forget_tweets(tweet_ids)
+            fragments.invalidate(tweet_ids)
+
+        except UploadTooLarge:
+            msg = 'File is too large'
+            logger.error(f"Profile picture upload too large for user {user.id}")
+            return templates.TemplateResponse("settings.html", {"request": request, "user": user, "msg": msg})
         except UnidentifiedImageError:
             msg = 'File is not a valid image'
             logger.error(f"File is not a valid image for user {user.id}")
             return templates.TemplateResponse("settings.html", {"request": request, "user": user, "msg": msg})
         except SQLAlchemyError as db_err:
-            db.rollback()
+            await db.rollback()
             logger.error(f"Database error: {db_err}")
             msg = 'Database error occurred'
             return templates.TemplateResponse("settings.html", {"request": request, "user": user, "msg": msg})
@@ -168,8 +174,8 @@ async def profile_picture_upload(request: Request, user, file: UploadFile = File
 
 @router.post("/token")
 async def login_for_access_token(response: Response, form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-                                 db: db_dependency):
-    user = authenticate_user(form_data.username, form_data.password, db)
+                                 db: read_db_dependency):
+    user = await authenticate_user(form_data.username, form_data.password, db)
     if not user:
         return False
 
@@ -191,7 +197,7 @@ async def auth_page(request: Request):
 
 
 @router.post("/", response_class=HTMLResponse)
-async def login(request: Request, db: db_dependency):
+async def login(request: Request, db: read_db_dependency):
     try:
         form = LoginForm(request)
         await form.create_oauth_form()
@@ -205,6 +211,10 @@ async def login(request: Request, db: db_dependency):
 
         return response
 
+    except PasswordHashQueueFull:
+        msg = 'Too many login attempts right now, please try again in a moment'
+        return templates.TemplateResponse('login.html', {'request': request, 'msg': msg})
+
     except HTTPException:
         msg = 'Unknown Error'
         return templates.TemplateResponse('login.html', {'request': request, 'msg': msg})
@@ -219,11 +229,11 @@ async def auth_page(request: Request):
 async def register(request: Request, email: str = Form(...), username: str = Form(...),
                    firstname: str = Form(...), lastname: str = Form(...),
                    password: str = Form(...), repeat_password: str = Form(...),
-                   phonenumber: str = Form(...), db: Session = Depends(get_db),
+                   phonenumber: str = Form(...), db: AsyncSession = Depends(get_db),
                    file: UploadFile = File(None)):
 
-    validation1 = db.query(Users).filter(Users.username == username).first()
-    validation2 = db.query(Users).filter(Users.email == email).first()
+    validation1 = await db.scalar(select(Users).where(Users.username == username))
+    validation2 = await db.scalar(select(Users).where(Users.email == email))
 
     if password != repeat_password:
         msg = 'Invalid registration request: Passwords do not match'
@@ -249,17 +259,18 @@ async def register(request: Request, email: str = Form(...), username: str = For
     user_model.last_name = lastname
     user_model.phone_number = phonenumber
 
-    hash_password = get_password_hash(password)
-    user_model.hashed_password = hash_password
+    try:
+        user_model.hashed_password = await hash_password(password)
+    except PasswordHashQueueFull:
+        msg = 'Too many registrations right now, please try again in a moment'
+        return templates.TemplateResponse("register.html", {'request': request, 'msg': msg})
     user_model.is_active = True
     user_model.role = None
 
     db.add(user_model)
-    db.commit()
-
-    user_data = db.query(Users).filter(Users.username == username).first()
+    await db.commit()
 
-    await profile_picture_upload(request, user_data, file, db)
+    await profile_picture_upload(request, user_model, file, db)
 
     msg = 'User successfully created'
     return templates.TemplateResponse("login.html", {'request': request, 'msg': msg})
@@ -1,23 +1,27 @@
-import os
 import logging
-from typing import Annotated
-from fastapi import APIRouter, Depends, Request, Form, UploadFile, File
-from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import Session
+from typing import Annotated, Optional
+from fastapi import APIRouter, Depends, Request, Form, UploadFile, File, Query
+from sqlalchemy import select, update
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 from starlette import status
-from fastapi.responses import JSONResponse, RedirectResponse
+from fastapi.responses import JSONResponse, RedirectResponse, Response, StreamingResponse
+from jinja2 import Environment, FileSystemLoader
+from markupsafe import Markup
 
 from ..models import *
-from ..database import SessionLocal
+from ..database import get_db, get_read_db, get_read_sessionmaker
+from ..feed import (feed_query, load_tweet, read_page, search_tweets, stream_page, feed_etag, etag_matches,
+                    cache_headers)
+from .. import timeline, fragments, likes
 from .auth import get_current_user, get_authenticated_user
 
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 
-from PIL import Image, UnidentifiedImageError
-from io import BytesIO
+from PIL import UnidentifiedImageError
 
-from ..tasks.tasks import compress_img
+from ..uploads import receive_image, store_image, UploadTooLarge
 
 router = APIRouter(
     prefix="/tweets",
@@ -25,53 +29,44 @@ router = APIRouter(
 )
 
 templates = Jinja2Templates(directory="./blog_app/templates")
+# Async environment for pages that are sent while they render, its for loops accept async iterators
+streaming_templates = Jinja2Templates(env=Environment(loader=FileSystemLoader("./blog_app/templates"),
+                                                      autoescape=True, enable_async=True))
 logger = logging.getLogger(__name__)
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+FEED_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 500
+# Pages longer than this are streamed from Postgres instead of assembled from the Redis timeline
+FEED_STREAM_THRESHOLD = 50
+FEED_STREAM_CHUNK_SIZE = 50
 
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
+read_sessionmaker_dependency = Annotated[async_sessionmaker, Depends(get_read_sessionmaker)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 authenticated_user_dependency = Annotated[dict, Depends(get_authenticated_user)]
 
 
-def get_username_by_id(user_id, db: Session):
-    user = db.query(Users).filter(Users.id == user_id).first()
-    return user.username if user else "Unknown"
-
-
-async def tweet_picture_upload(request: Request, tweet: Tweets, file: UploadFile = File(None), db: Session = Depends(get_db)):
+async def tweet_picture_upload(request: Request, tweet: Tweets, file: UploadFile = File(None), db: AsyncSession = Depends(get_db)):
     if file and file.filename != "":
         try:
-            contents = await file.read()
-            image = Image.open(BytesIO(contents))
-
-            output = BytesIO()
-            image.save(output, format="PNG")
-            output.seek(0)
-
-            image_dir = "./blog_app/static/images/tweets/"
-            if not os.path.exists(image_dir):
-                os.makedirs(image_dir)
-
-            file_path = os.path.join(image_dir, f"{tweet.id}.png")
-
-            with open(file_path, "wb") as f:
-                f.write(output.read())
-
-            compress_img.delay(file_path)
+            upload_path, digest = await receive_image(file)
+            image = await store_image(db, 'tweets', upload_path, digest)
 
             tweet.has_image = True
-            tweet.image_id = tweet.id
+            tweet.image_id = image.id
 
             db.add(tweet)
-            db.commit()
+            await db.commit()
 
 
+        except UploadTooLarge:
+            logger.error(f"Image upload too large for tweet {tweet.id}")
+            return RedirectResponse(
+                url=f"/tweets/add_tweet?msg=Image file is too large&tweet_text={tweet.new_tweet}",
+                status_code=status.HTTP_302_FOUND
+            )
+
         except UnidentifiedImageError:
             logger.error(f"File is not a valid image for tweet {tweet.id}")
             return RedirectResponse(
@@ -80,7 +75,7 @@ async def tweet_picture_upload(request: Request, tweet: Tweets, file: UploadFile
             )
 
         except SQLAlchemyError as db_err:
-            db.rollback()
+            await db.rollback()
             logger.error(f"Database error: {db_err}")
             return RedirectResponse(
                 url=f"/tweets/add_tweet?msg=Database error occurred&tweet_text={tweet.new_tweet}",
@@ -102,26 +97,94 @@ async def tweet_picture_upload(request: Request, tweet: Tweets, file: UploadFile
             )
 
 
+def stream_feed(request: Request, sessionmaker: async_sessionmaker, template_name: str, query, user: dict,
+                before: Optional[int], limit: int, headers: dict):
+    # The layout is sent before the first row is fetched, then every chunk of cards as soon as it is
+    # rendered. The dependency's session is closed before a streamed body starts, so the body opens
+    # its own.
+    page = {'next_before': None}
+
+    async def cards(db: AsyncSession):
+        async for tweets in stream_page(db, query, before, limit, FEED_STREAM_CHUNK_SIZE, page):
+            liked_ids = await likes.liked_tweet_ids(db, user.get('id'),
+                                                    [tweet['original_id'] or tweet['id'] for tweet in tweets])
+            yield Markup('').join(await fragments.render_cards(tweets, user, liked_ids))
+
+    async def body():
+        template = streaming_templates.get_template(template_name)
+        async with sessionmaker() as db:
+            context = {"request": request, "cards": cards(db), 'user': user, 'page': page, 'limit': limit}
+            try:
+                async for chunk in template.generate_async(context):
+                    yield chunk
+            except Exception as e:
+                # The status line is already sent, all that can be done is to end the page early
+                logger.error(f"Streaming {template_name} failed: {e}")
+
+    return StreamingResponse(body(), media_type="text/html", headers=headers)
+
+
 @router.get("/", response_class=HTMLResponse)
-async def read_all(request: Request, db: db_dependency, user: authenticated_user_dependency):
+async def read_all(request: Request, db: read_db_dependency, sessionmaker: read_sessionmaker_dependency,
+                   user: authenticated_user_dependency,
+                   before: Optional[int] = Query(None, gt=0),
+                   limit: int = Query(FEED_PAGE_SIZE, ge=1, le=FEED_MAX_PAGE_SIZE)):
 
-    tweets = db.query(Tweets).order_by(Tweets.id.desc()).all()
+    etag = await feed_etag(timeline.GLOBAL_TIMELINE, user.get('id'), before, limit)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag))
 
-    for tweet in tweets:
-        if tweet.retweeted:
-            tweet.op_username = get_username_by_id(tweet.op_id, db)
+    if limit > FEED_STREAM_THRESHOLD:
+        return stream_feed(request, sessionmaker, "home.html", feed_query(), user, before, limit, cache_headers(etag))
 
-    return templates.TemplateResponse("home.html", {"request": request, "tweets": tweets, 'user': user})
+    tweets, next_before = await read_page(db, timeline.GLOBAL_TIMELINE, feed_query(), before, limit)
+    liked_ids = await likes.liked_tweet_ids(db, user.get('id'), [tweet['original_id'] or tweet['id'] for tweet in tweets])
+    cards = await fragments.render_cards(tweets, user, liked_ids)
+
+    return templates.TemplateResponse("home.html", {"request": request, "cards": cards, 'user': user,
+                                                    'page': {'next_before': next_before}, 'limit': limit},
+                                      headers=cache_headers(etag))
 
 @router.get("/users/{user_id}", response_class=HTMLResponse)
-async def read_all_by_user(request: Request, db: db_dependency, user_id: int, user: authenticated_user_dependency):
+async def read_all_by_user(request: Request, db: read_db_dependency, sessionmaker: read_sessionmaker_dependency,
+                           user_id: int, user: authenticated_user_dependency,
+                           before: Optional[int] = Query(None, gt=0),
+                           limit: int = Query(FEED_PAGE_SIZE, ge=1, le=FEED_MAX_PAGE_SIZE)):
+
+    key = timeline.user_timeline(user_id)
+    etag = await feed_etag(key, user.get('id'), before, limit)
+    if etag_matches(request.headers.get('if-none-match'), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=cache_headers(etag))
 
-    tweets = db.query(Tweets).filter(Tweets.owner_id == user_id).order_by(Tweets.id.desc()).all()
-    for tweet in tweets:
-        if tweet.retweeted:
-            tweet.op_username = get_username_by_id(tweet.op_id, db)
+    query = feed_query().where(Tweets.owner_id == user_id)
+    if limit > FEED_STREAM_THRESHOLD:
+        return stream_feed(request, sessionmaker, "user_page.html", query, user, before, limit, cache_headers(etag))
 
-    return templates.TemplateResponse("user_page.html", {"request": request, "tweets": tweets, 'user': user})
+    tweets, next_before = await read_page(db, key, query, before, limit)
+    liked_ids = await likes.liked_tweet_ids(db, user.get('id'), [tweet['original_id'] or tweet['id'] for tweet in tweets])
+    cards = await fragments.render_cards(tweets, user, liked_ids)
+
+    return templates.TemplateResponse("user_page.html", {"request": request, "cards": cards, 'user': user,
+                                                         'page': {'next_before': next_before}, 'limit': limit},
+                                      headers=cache_headers(etag))
+
+
+@router.get("/search", response_class=HTMLResponse)
+async def search(request: Request, db: read_db_dependency, user: authenticated_user_dependency,
+                 q: str = Query("", max_length=200),
+                 rank: Optional[float] = Query(None, ge=0),
+                 before: Optional[int] = Query(None, gt=0),
+                 limit: int = Query(FEED_PAGE_SIZE, ge=1, le=FEED_MAX_PAGE_SIZE)):
+
+    cards, next_rank, next_before = [], None, None
+    if q.strip():
+        tweets, (next_rank, next_before) = await search_tweets(db, q, rank, before, limit)
+        liked_ids = await likes.liked_tweet_ids(db, user.get('id'), [tweet['id'] for tweet in tweets])
+        cards = await fragments.render_cards(tweets, user, liked_ids)
+
+    return templates.TemplateResponse("search.html", {"request": request, "cards": cards, 'user': user, 'q': q,
+                                                      'next_rank': next_rank, 'next_before': next_before,
+                                                      'limit': limit})
 
 
 @router.get("/add_tweet", response_class=HTMLResponse)
@@ -143,49 +206,48 @@ async def new_tweet(
 
     tweet_model = Tweets()
     tweet_model.new_tweet = new_tweet or ""
-    tweet_model.liked = False
     tweet_model.owner_id = user.get("id")
 
     db.add(tweet_model)
-    db.commit()
-
-    tweet = db.query(Tweets).filter(Tweets.id == tweet_model.id).first()
+    await db.commit()
 
+    response = None
     if file and file.filename != "":
-        response = await tweet_picture_upload(request, tweet, file, db)
-        if response:
-            return response
+        response = await tweet_picture_upload(request, tweet_model, file, db)
+
+    await timeline.push_tweet((await load_tweet(db, tweet_model.id)).to_dict())
+
+    if response:
+        return response
 
     return RedirectResponse(url='/tweets', status_code=status.HTTP_302_FOUND)
 
 
 @router.post("/retweet/{tweet_id}", response_class=HTMLResponse)
 async def retweet(request: Request, tweet_id: int, db: db_dependency, user: authenticated_user_dependency):
-    original_tweet = db.query(Tweets).filter(Tweets.id == tweet_id).first()
+    original_tweet = await db.get(Tweets, tweet_id)
     if original_tweet is None:
         return RedirectResponse(url="/tweets", status_code=status.HTTP_404_NOT_FOUND)
 
+    # Retweeting a retweet shares the tweet it points at, so there is never a chain to follow
     new_tweet = Tweets(
-        new_tweet=original_tweet.new_tweet,
-        liked=False,
-        has_image=original_tweet.has_image,
-        image_id=original_tweet.image_id,
         owner_id=user.get('id'),
-        retweeted=True,
-        op_id=original_tweet.owner_id
+        original_id=original_tweet.original_id or original_tweet.id,
     )
 
     db.add(new_tweet)
-    db.commit()
+    await db.commit()
+
+    await timeline.push_tweet((await load_tweet(db, new_tweet.id)).to_dict())
 
     return RedirectResponse(url='/tweets', status_code=status.HTTP_302_FOUND)
 
 
 @router.get("/edit_tweet/{tweet_id}", response_class=HTMLResponse)
-async def edit_tweet(request: Request, tweet_id: int, db: db_dependency, user: authenticated_user_dependency):
-    tweet = db.query(Tweets).filter(Tweets.id == tweet_id).first()
+async def edit_tweet(request: Request, tweet_id: int, db: read_db_dependency, user: authenticated_user_dependency):
+    tweet = await db.get(Tweets, tweet_id)
 
-    if tweet.owner_id != user.get('id'):
+    if tweet is None or tweet.owner_id != user.get('id') or tweet.retweeted:
         return RedirectResponse(url='/tweets', status_code=status.HTTP_302_FOUND)
 
     return templates.TemplateResponse("edit_tweet.html", {"request": request, "tweet": tweet, 'user': user})
@@ -195,15 +257,29 @@ async def edit_tweet(request: Request, tweet_id: int, db: db_dependency, user: a
 async def edit_tweet_commit(request: Request, tweet_id: int, db: db_dependency, user: authenticated_user_dependency,
                             new_tweet: str = Form(...)):
 
-    tweet_model = db.query(Tweets).filter(Users.id == user.get('id')).filter(Tweets.id == tweet_id).first()
+    tweet_model = await db.scalar(
+        select(Tweets).where(Tweets.id == tweet_id, Tweets.owner_id == user.get('id'), Tweets.original_id.is_(None))
+    )
 
     if tweet_model is None:
         return RedirectResponse(url='/tweets', status_code=status.HTTP_302_FOUND)
 
     tweet_model.new_tweet = new_tweet
+    tweet_model.version += 1
 
     db.add(tweet_model)
-    db.commit()
+
+    # Retweets show the original's text, so their cached payloads and cards are stale as well
+    result = await db.scalars(
+        update(Tweets).where(Tweets.original_id == tweet_model.id)
+        .values(version=Tweets.version + 1).returning(Tweets.id)
+    )
+    tweet_ids = [tweet_model.id, *result.all()]
+
+    await db.commit()
+
+    await timeline.forget_tweets(tweet_ids)
+    fragments.invalidate(tweet_ids)
 
     return RedirectResponse(url='/tweets', status_code=status.HTTP_302_FOUND)
 
@@ -211,24 +287,45 @@ async def edit_tweet_commit(request: Request, tweet_id: int, db: db_dependency,
 @router.post("/delete/{tweet_id}", response_class=HTMLResponse)
 async def delete_tweet(request: Request, tweet_id: int, db: db_dependency, user: authenticated_user_dependency):
 
-    tweet_model = db.query(Tweets).filter(Tweets.id == tweet_id).filter(Tweets.owner_id == user.get('id')).first()
+    tweet_model = await db.scalar(
+        select(Tweets).where(Tweets.id == tweet_id, Tweets.owner_id == user.get('id'))
+    )
 
     if tweet_model is None:
         return RedirectResponse(url='/tweets', status_code=status.HTTP_302_FOUND)
 
-    db.delete(tweet_model)
-    db.commit()
+    # Retweets are removed by the foreign key cascade, the caches have to forget them too
+    result = await db.execute(select(Tweets.id, Tweets.owner_id).where(Tweets.original_id == tweet_model.id))
+    removed = [(tweet_model.id, tweet_model.owner_id), *((row.id, row.owner_id) for row in result)]
+
+    await db.delete(tweet_model)
+    await db.commit()
+
+    await timeline.remove_tweets(removed)
+    fragments.invalidate([tweet_id for tweet_id, _ in removed])
 
     return RedirectResponse(url='/tweets', status_code=status.HTTP_302_FOUND)
 
 
-@router.get("/like/{tweet_id}", response_class=HTMLResponse)
+@router.post("/like/{tweet_id}")
 async def like_tweet(request: Request, tweet_id: int, db: db_dependency, user: authenticated_user_dependency):
-    tweet = db.query(Tweets).filter(Tweets.id == tweet_id).first()
-
-    tweet.liked = not tweet.liked
+    # Likes are not part of the cached card, so nothing has to be invalidated here
+    tweet = await db.get(Tweets, tweet_id)
+    if tweet is None:
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
+                            content={"status": "error", "detail": "Tweet not found"})
+
+    # Likes live on the original, a retweet's id likes the tweet it shares
+    liked_id = tweet.original_id or tweet.id
+    try:
+        delta = await likes.toggle_like(db, user.get('id'), liked_id)
+    except IntegrityError:
+        await db.rollback()
+        return JSONResponse(status_code=status.HTTP_404_NOT_FOUND,
+                            content={"status": "error", "detail": "Tweet not found"})
 
-    db.add(tweet)
-    db.commit()
+    await likes.record_like(db, liked_id, delta)
+    # The like button on this user's feed pages changed, their ETags must not match any more
+    await timeline.touch_viewer(user.get('id'))
 
-    return JSONResponse(content={"status": "success", "liked": tweet.liked})
+    return JSONResponse(content={"status": "success", "liked": delta >= 0})
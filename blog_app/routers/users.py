@@ -3,14 +3,15 @@ from typing import Annotated
 
 from PIL import UnidentifiedImageError, Image
 from fastapi import APIRouter, Depends, Request, Form, UploadFile, File
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 from starlette.responses import RedirectResponse
 from ..models import *
-from ..database import SessionLocal
-from .auth import get_current_user, verify_password, get_password_hash, profile_picture_upload, is_password_strong, get_authenticated_user
+from ..database import get_db
+from .auth import get_current_user, profile_picture_upload, is_password_strong, get_authenticated_user
+from ..hashing import hash_password, check_password, PasswordHashQueueFull
 from ..tasks.tasks import compress_img
-from passlib.context import CryptContext
 
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
@@ -23,22 +24,13 @@ router = APIRouter(
 )
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-db_dependency = Annotated[Session, Depends(get_db)]
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
 user_dependency = Annotated[dict, Depends(get_current_user)]
 authenticated_user_dependency = Annotated[dict, Depends(get_authenticated_user)]
-bcrypt_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
 templates = Jinja2Templates(directory="./blog_app/templates")
 
 
-def change_password(request: Request, user_data, password, password2):
+async def change_password(request: Request, user_data, password, password2):
     if password2:
         if not password:
             return False, "You should enter your current password to change it"
@@ -47,8 +39,8 @@ def change_password(request: Request, user_data, password, password2):
             return False, ("Password must be at least 12 characters long, with at least one lowercase letter, "
                            "one uppercase letter, one number, and one special character.")
 
-        if verify_password(password, user_data.hashed_password):
-            user_data.hashed_password = get_password_hash(password2)
+        if await check_password(password, user_data.hashed_password):
+            user_data.hashed_password = await hash_password(password2)
             return True, "Password successfully updated"
         else:
             return False, "Current password is incorrect"
@@ -69,12 +61,12 @@ async def settings_change(request: Request, db: db_dependency, user: authenticat
                           phonenumber: str = Form(None), file: UploadFile = File(None),
                           password: str = Form(None), new_password: str = Form(None)):
 
-    user_data = db.query(Users).filter(Users.id == user.get('id')).first()
+    user_data = await db.get(Users, user.get('id'))
 
     changes_made = False
     msg = "No changes were made"
 
-    validation = db.query(Users).filter(Users.email == email).first()
+    validation = await db.scalar(select(Users).where(Users.email == email))
 
     if email and email != user_data.email and validation is None:
         user_data.email = email
@@ -92,7 +84,10 @@ async def settings_change(request: Request, db: db_dependency, user: authenticat
         user_data.phone_number = phonenumber
         changes_made = True
 
-    password_changed, password_msg = change_password(request, user_data, password, new_password)
+    try:
+        password_changed, password_msg = await change_password(request, user_data, password, new_password)
+    except PasswordHashQueueFull:
+        password_changed, password_msg = False, "Server is busy, please try changing your password again later"
 
     if password_changed:
         changes_made = True
@@ -105,7 +100,7 @@ async def settings_change(request: Request, db: db_dependency, user: authenticat
 
     if changes_made:
         db.add(user_data)
-        db.commit()
+        await db.commit()
         msg = "Information updated"
 
     return templates.TemplateResponse("settings.html", {"request": request, "user": user, "msg": msg})
\ No newline at end of file
@@ -0,0 +1,49 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+from .database import engine, read_engine
+
+# Recorders of the current request, each one has add(statement, parameters, duration). The
+# metrics and the SQL profiler both register one, the statements are only timed once.
+# SQLAlchemy runs the async engine's events in a greenlet that shares the caller's context,
+# so the listeners see the request's value.
+current_recorders: ContextVar = ContextVar('current_recorders', default=())
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution context, which is discarded if the statement fails
+    context._sql_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    recorders = current_recorders.get()
+    if not recorders:
+        return
+
+    duration = time.perf_counter() - context._sql_started
+    for recorder in recorders:
+        recorder.add(statement, parameters, duration)
+
+
+def instrument_engine(target):
+    if event.contains(target.sync_engine, 'after_cursor_execute', _after_cursor_execute):
+        return
+    event.listen(target.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(target.sync_engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+instrument_engine(engine)
+if read_engine is not None:
+    instrument_engine(read_engine)
+
+
+@contextmanager
+def recording(recorder):
+    token = current_recorders.set(current_recorders.get() + (recorder,))
+    try:
+        yield recorder
+    finally:
+        current_recorders.reset(token)
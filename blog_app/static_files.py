@@ -0,0 +1,177 @@
+import argparse
+import gzip
+import logging
+import mimetypes
+import os
+import re
+from pathlib import Path
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+
+try:
+    import brotli
+except ImportError:  # gzip siblings still work without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_ROOT = "./blog_app/static"
+
+# Stored images are named after the sha256 of their content (see uploads.store_image), so the
+# bytes behind such a URL never change
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Everything else (CSS, JS, images from before content addressing) may change under the same
+# URL; browsers keep it but revalidate with the ETag/Last-Modified StaticFiles already sends
+REVALIDATE_CACHE_CONTROL = 'public, no-cache'
+
+# '' serves files from Python. 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd)
+# only answers with a header and the front proxy streams the file itself.
+STATIC_OFFLOAD = os.getenv('STATIC_OFFLOAD', '').lower()
+# nginx "internal" location that aliases the static directory
+STATIC_OFFLOAD_PREFIX = os.getenv('STATIC_OFFLOAD_PREFIX', '/protected-static/')
+
+# Text assets worth compressing; images are already compressed formats
+COMPRESSIBLE_SUFFIXES = {'.css', '.js', '.map', '.svg', '.html', '.json', '.txt', '.xml'}
+# Preferred first when a client accepts both
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+# A sibling that saves less than this is not worth a second representation
+MIN_COMPRESSION_RATIO = 0.9
+
+_CONTENT_ADDRESSED = re.compile(r'[\\/]images[\\/]\w+[\\/][0-9a-f]{2}[\\/][0-9a-f]{64}(_\d+)?\.\w+$')
+
+
+def is_content_addressed(path: str) -> bool:
+    return _CONTENT_ADDRESSED.search(path) is not None
+
+
+def accepted_encodings(accept_encoding: str):
+    # Encodings named with a non-zero q value; "gzip;q=0" explicitly refuses gzip
+    accepted = set()
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.strip().partition(';')
+        if not name:
+            continue
+        q = params.strip()
+        if q.startswith('q='):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip())
+    return accepted
+
+
+class CachedStaticFiles(StaticFiles):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.root = os.path.realpath(self.directory) if self.directory is not None else None
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        full_path = str(full_path)
+        cache_control = IMMUTABLE_CACHE_CONTROL if is_content_addressed(full_path) else REVALIDATE_CACHE_CONTROL
+
+        if STATIC_OFFLOAD in ('x-accel-redirect', 'x-sendfile'):
+            return self.offload_response(full_path, cache_control)
+
+        request_headers = Headers(scope=scope)
+        compressible = Path(full_path).suffix in COMPRESSIBLE_SUFFIXES
+        response = None
+        if compressible:
+            response = self.precompressed_response(full_path, request_headers.get('accept-encoding', ''))
+        if response is None:
+            response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+
+        response.headers['Cache-Control'] = cache_control
+        if compressible:
+            response.headers['Vary'] = 'Accept-Encoding'
+
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    @staticmethod
+    def precompressed_response(full_path: str, accept_encoding: str):
+        # Siblings written by the build step (main() below); each one is its own file with its own
+        # ETag, so caches never mix up the encodings
+        accepted = accepted_encodings(accept_encoding)
+        for encoding, suffix in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            try:
+                stat_result = os.stat(full_path + suffix)
+            except FileNotFoundError:
+                continue
+            media_type = mimetypes.guess_type(full_path)[0] or 'text/plain'
+            return FileResponse(full_path + suffix, stat_result=stat_result, media_type=media_type,
+                                headers={'Content-Encoding': encoding})
+        return None
+
+    def offload_response(self, full_path: str, cache_control: str):
+        # Content-Type is left to the proxy, it knows the file it serves
+        headers = {'Cache-Control': cache_control}
+        if STATIC_OFFLOAD == 'x-sendfile':
+            headers['X-Sendfile'] = full_path
+        else:
+            relative = Path(os.path.relpath(full_path, self.root)).as_posix()
+            headers['X-Accel-Redirect'] = STATIC_OFFLOAD_PREFIX.rstrip('/') + '/' + relative
+        return Response(headers=headers)
+
+
+def compress_file(path: Path, force: bool = False):
+    data = path.read_bytes()
+    written = []
+    for encoding, suffix in ENCODINGS:
+        if encoding == 'br' and brotli is None:
+            continue
+
+        target = path.with_name(path.name + suffix)
+        if not force and target.exists() and target.stat().st_mtime >= path.stat().st_mtime:
+            continue
+
+        if encoding == 'br':
+            compressed = brotli.compress(data, quality=11)
+        else:
+            # mtime=0 keeps the output, and so its ETag, identical between builds
+            compressed = gzip.compress(data, compresslevel=9, mtime=0)
+
+        if len(compressed) > len(data) * MIN_COMPRESSION_RATIO:
+            target.unlink(missing_ok=True)
+            continue
+
+        tmp_path = target.with_name(f".{target.name}.tmp")
+        tmp_path.write_bytes(compressed)
+        os.replace(tmp_path, target)
+        # The sibling carries the source's mtime, so Last-Modified matches the uncompressed file
+        os.utime(target, (path.stat().st_atime, path.stat().st_mtime))
+        written.append(target)
+    return written
+
+
+def precompress(root: str, force: bool = False):
+    count = 0
+    for path in sorted(Path(root).rglob('*')):
+        if path.is_file() and path.suffix in COMPRESSIBLE_SUFFIXES:
+            for target in compress_file(path, force):
+                logger.info(f"Wrote {target}")
+                count += 1
+    if brotli is None:
+        logger.warning("brotli is not installed, only gzip siblings were written")
+    logger.info(f"Wrote {count} precompressed files")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write .gz and .br siblings of the static text assets")
+    parser.add_argument('--root', default=STATIC_ROOT)
+    parser.add_argument('--force', action='store_true', help="recompress files whose siblings are up to date")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    precompress(args.root, args.force)
+
+
+if __name__ == '__main__':
+    main()
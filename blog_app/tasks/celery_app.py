@@ -1,11 +1,22 @@
 from celery import Celery
 
+from blog_app.likes import LIKE_FLUSH_INTERVAL
+
 celery_app = Celery(
     'blog_app',
     broker='redis://redis:6379/0',
-    backend='redis://redis:6379/0'
+    backend='redis://redis:6379/0',
+    include=['blog_app.tasks.tasks'],
 )
 
 celery_app.conf.update(
     result_expires=3600,
-)
\ No newline at end of file
+    beat_schedule={
+        'flush-like-counts': {
+            'task': 'blog_app.tasks.tasks.flush_like_counts',
+            'schedule': LIKE_FLUSH_INTERVAL,
+            # A flush that could not run in time is superseded by the next one
+            'options': {'expires': LIKE_FLUSH_INTERVAL},
+        },
+    },
+)
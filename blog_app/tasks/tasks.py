@@ -1,31 +1,89 @@
+import asyncio
 import logging
+import os
 from PIL import Image, ImageOps
 from pathlib import Path
 
+from redis.asyncio import Redis
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import NullPool
+
 from blog_app.tasks.celery_app import celery_app as celery
+from blog_app.images import write_variants
+from blog_app.cache import REDIS_URL
+from blog_app.database import SQLALCHEMY_DATABASE_URL
+from blog_app import likes
 
 logger = logging.getLogger(__name__)
 
+TWEET_IMAGE_SIZE = (800, 800)
+PROFILE_PICTURE_SIZE = (200, 200)
+
+
 @celery.task
-def compress_img(image_path: str):
+def compress_img(upload_path: str, image_path: str, kind: str = None):
+    # The API only streams the raw upload to disk; this is the single place where it gets
+    # decoded, resized and encoded into the PNG fallback and the responsive variants.
+    upload_path = Path(upload_path).resolve()
+    image_path = Path(image_path).resolve()
+
     try:
-        image_path = Path(image_path)
-
-        if not image_path.is_absolute():
-            logger.warning(f"Relative path provided, converting to absolute path: {image_path}")
-            image_path = image_path.resolve()
-
-        if image_path.parent.name == 'tweets':
-            logger.info(f"Processing tweet image: {image_path}")
-            image = Image.open(image_path)
-            image = ImageOps.contain(image, (800, 800))
-        else:
-            logger.info(f"Processing profile picture image: {image_path}")
-            image = Image.open(image_path)
-            image.thumbnail((200, 200))
-
-        image.save(image_path)
+        kind = kind or image_path.parent.name
+        is_tweet_image = kind == 'tweets'
+        size = TWEET_IMAGE_SIZE if is_tweet_image else PROFILE_PICTURE_SIZE
+
+        with Image.open(upload_path) as image:
+            # Lets JPEG decode at a reduced scale straight away instead of at full resolution
+            image.draft('RGB', size)
+            image = ImageOps.exif_transpose(image)
+
+            if is_tweet_image:
+                logger.info(f"Processing tweet image: {image_path}")
+                image = ImageOps.contain(image, size)
+            else:
+                logger.info(f"Processing profile picture image: {image_path}")
+                image.thumbnail(size)
+
+            if image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P'):
+                image = image.convert('RGBA')
+
+            image_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = image_path.with_name(f".{image_path.name}.tmp")
+            image.save(tmp_path, format='PNG', optimize=True)
+            os.replace(tmp_path, image_path)
+
+            write_variants(image, image_path, kind)
+
         logger.info(f"Image saved successfully: {image_path}")
 
     except Exception as e:
-        logger.error(f"Failed to process image at {image_path}: {str(e)}")
+        logger.error(f"Failed to process image at {upload_path}: {str(e)}")
+
+    finally:
+        upload_path.unlink(missing_ok=True)
+
+
+async def _flush_like_counts():
+    # Every run has its own event loop, so it opens its own connections instead of using the
+    # app's pooled engine and Redis client, which are bound to the loop that created them
+    engine = create_async_engine(SQLALCHEMY_DATABASE_URL, poolclass=NullPool)
+    client = Redis.from_url(REDIS_URL, decode_responses=True)
+    try:
+        async with AsyncSession(engine, expire_on_commit=False) as db:
+            return await likes.flush_like_counts(db, client)
+    finally:
+        await client.close()
+        await engine.dispose()
+
+
+@celery.task
+def flush_like_counts():
+    try:
+        flushed = asyncio.run(_flush_like_counts())
+    except Exception as e:
+        logger.error(f"Failed to flush like counts: {str(e)}")
+        return 0
+
+    if flushed:
+        logger.info(f"Flushed like counts for {flushed} tweets")
+    return flushed
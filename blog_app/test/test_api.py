@@ -0,0 +1,85 @@
+from .utils import *
+from ..routers.api import get_api_user, get_db, get_read_db, serialize_tweet
+import pytest
+
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+
+
+@pytest.fixture
+def api_user(test_user):
+    app.dependency_overrides[get_api_user] = lambda: {'username': 'testuser', 'id': test_user.id}
+    yield test_user
+    app.dependency_overrides.pop(get_api_user, None)
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM tweets;"))
+        connection.commit()
+
+
+def test_api_requires_token():
+    response = client.get("/api/v1/tweets")
+
+    assert response.status_code == 401
+    assert response.json() == {"detail": "Not authenticated"}
+    assert response.headers["www-authenticate"] == "Bearer"
+
+
+def test_serialize_retweet():
+    payload = {'id': 2, 'original_id': 1, 'new_tweet': 'Hello', 'owner_id': 5, 'retweeted': True, 'op_id': 4,
+               'op_username': 'author', 'username': 'fan', 'image': None, 'avatar': None, 'op_avatar': 'ab/abcd',
+               'version': 1, 'like_count': 3}
+
+    tweet = serialize_tweet(payload, {1})
+
+    assert tweet['liked'] is True
+    assert tweet['retweet_of'] == {'id': 1, 'owner_id': 4, 'username': 'author',
+                                   'avatar_url': '/static/images/avas/ab/abcd.png'}
+
+
+def test_create_and_page_through_feed(api_user):
+    ids = [client.post("/api/v1/tweets", json={"text": f"Tweet {i}"}).json()['id'] for i in range(5)]
+
+    first = client.get("/api/v1/tweets?limit=3").json()
+    second = client.get(f"/api/v1/tweets?limit=3&before={first['next_before']}").json()
+
+    assert [tweet['id'] for tweet in first['tweets']] == ids[::-1][:3]
+    assert [tweet['id'] for tweet in second['tweets']] == ids[::-1][3:]
+    assert second['next_before'] is None
+    assert first['tweets'][0]['text'] == "Tweet 4"
+
+
+def test_like_and_retweet(api_user):
+    tweet_id = client.post("/api/v1/tweets", json={"text": "Original"}).json()['id']
+
+    assert client.post(f"/api/v1/tweets/{tweet_id}/like").json() == {"liked": True}
+    retweet = client.post(f"/api/v1/tweets/{tweet_id}/retweet")
+
+    assert retweet.status_code == 201
+    assert retweet.json()['retweet_of']['id'] == tweet_id
+    assert retweet.json()['liked'] is True
+    assert client.get(f"/api/v1/tweets/{tweet_id}").json()['liked'] is True
+    assert client.post(f"/api/v1/tweets/{tweet_id}/like").json() == {"liked": False}
+
+
+def test_like_through_retweet_likes_original(api_user):
+    tweet_id = client.post("/api/v1/tweets", json={"text": "Original"}).json()['id']
+    retweet_id = client.post(f"/api/v1/tweets/{tweet_id}/retweet").json()['id']
+
+    assert client.post(f"/api/v1/tweets/{retweet_id}/like").json() == {"liked": True}
+
+    with engine.connect() as connection:
+        liked = connection.execute(text("SELECT tweet_id FROM likes")).scalars().all()
+    assert liked == [tweet_id]
+    assert client.get(f"/api/v1/tweets/{retweet_id}").json()['liked'] is True
+    assert client.get(f"/api/v1/tweets/{tweet_id}").json()['liked'] is True
+
+    assert client.post(f"/api/v1/tweets/{tweet_id}/like").json() == {"liked": False}
+    assert client.get(f"/api/v1/tweets/{retweet_id}").json()['liked'] is False
+
+
+def test_missing_tweet_is_404(api_user):
+    assert client.get("/api/v1/tweets/999999").status_code == 404
+    assert client.post("/api/v1/tweets/999999/like").status_code == 404
+    assert client.post("/api/v1/tweets/999999/retweet").status_code == 404
+    assert client.post("/api/v1/tweets", json={"text": ""}).status_code == 422
@@ -2,12 +2,14 @@ from unittest.mock import patch, AsyncMock, MagicMock
 
 from .utils import *
 from ..routers.auth import *
+from ..token_cache import TokenCache
 from jose import jwt
 from datetime import timedelta, datetime, timezone
 import pytest
 
 
 app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
 
 def test_verify_password():
     plain_password = "testpassword"
@@ -19,18 +21,34 @@ def test_verify_password():
     assert verify_password(wrong_password, hashed_password) == False
 
 
-def test_authenticate_user(test_user):
-    db = TestingSessionLocal()
+@pytest.mark.asyncio
+async def test_hash_password_in_executor():
+    hashed_password = await hash_password("testpassword")
+
+    assert await check_password("testpassword", hashed_password) is True
+    assert await check_password("wrongpassword", hashed_password) is False
+
+
+@pytest.mark.asyncio
+async def test_password_hash_queue_full():
+    with patch("blog_app.hashing.PASSWORD_HASH_WORKERS", 0), \
+            patch("blog_app.hashing.PASSWORD_HASH_MAX_QUEUE", 0):
+        with pytest.raises(PasswordHashQueueFull):
+            await hash_password("testpassword")
 
-    authenticated_user = authenticate_user(test_user.username, 'testpassword', db)
-    assert authenticated_user is not None
-    assert authenticated_user.username == test_user.username
 
-    non_existent_user = authenticate_user('wrong_username', 'testpassword', db)
-    assert non_existent_user is False
+@pytest.mark.asyncio
+async def test_authenticate_user(test_user):
+    async with AsyncTestingSessionLocal() as db:
+        authenticated_user = await authenticate_user(test_user.username, 'testpassword', db)
+        assert authenticated_user is not None
+        assert authenticated_user.username == test_user.username
 
-    wrong_password_user = authenticate_user(test_user.username, 'wrongpassword', db)
-    assert wrong_password_user is False
+        non_existent_user = await authenticate_user('wrong_username', 'testpassword', db)
+        assert non_existent_user is False
+
+        wrong_password_user = await authenticate_user(test_user.username, 'wrongpassword', db)
+        assert wrong_password_user is False
 
 
 def test_create_access_token():
@@ -88,6 +106,45 @@ async def test_get_current_user():
         assert mock_logout.call_count == 2
 
 
+@pytest.mark.asyncio
+async def test_get_current_user_token_cache():
+    verified_tokens.clear()
+    token = create_access_token("testuser", 1, "user", timedelta(minutes=15))
+    request_with_token = Request(scope={
+        "type": "http",
+        "headers": [(b"cookie", f"access_token={token}".encode())]
+    })
+
+    with patch("jose.jwt.decode", wraps=jwt.decode) as mock_decode:
+        assert await get_current_user(request_with_token) == {"username": "testuser", "id": 1}
+        assert await get_current_user(request_with_token) == {"username": "testuser", "id": 1}
+        assert mock_decode.call_count == 1
+
+    assert verified_tokens.hits == 1
+    assert verified_tokens.misses == 1
+
+    with patch("blog_app.routers.auth.TOKEN_CACHE_ENABLED", False), \
+            patch("jose.jwt.decode", wraps=jwt.decode) as mock_decode:
+        await get_current_user(request_with_token)
+        assert mock_decode.call_count == 1
+
+
+def test_token_cache_evicts_at_expiry():
+    cache = TokenCache(10)
+    cache.set("token", {"sub": "testuser", "id": 1, "exp": 1000})
+
+    assert cache.get("token", now=999) is not None
+    assert cache.get("token", now=1000) is None
+    assert len(cache) == 0
+
+
+def test_token_cache_skips_tokens_without_expiry():
+    cache = TokenCache(10)
+    cache.set("token", {"sub": "testuser", "id": 1})
+
+    assert len(cache) == 0
+
+
 def test_login_for_access_token(test_user):
     login_data = {
         "username": test_user.username,
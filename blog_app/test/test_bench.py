@@ -0,0 +1,53 @@
+import random
+from types import SimpleNamespace
+
+from ..bench.dataset import tweet_counts, tweet_records
+from ..bench.load import percentile, Recorder
+
+
+def test_percentile_nearest_rank():
+    values = list(range(1, 101))
+
+    assert percentile(values, 0.50) == 50
+    assert percentile(values, 0.99) == 99
+    assert percentile([7], 0.95) == 7
+    assert percentile([], 0.5) == 0.0
+
+
+def test_recorder_skips_warmup():
+    recorder = Recorder()
+    recorder.add('feed', 1.0, ok=True)
+    recorder.recording = True
+    recorder.add('feed', 0.010, ok=True)
+    recorder.add('feed', 0.030, ok=False)
+
+    report = recorder.report(elapsed=2.0)
+
+    assert report['routes']['feed']['requests'] == 2
+    assert report['routes']['feed']['errors'] == 1
+    assert report['throughput_rps'] == 1.0
+    assert report['routes']['feed']['max_ms'] == 30.0
+
+
+def test_dataset_tweet_counts_are_skewed():
+    random.seed(1)
+    counts = tweet_counts(20000, mean=20, alpha=1.5, cap=100000)
+
+    assert 15 < sum(counts) / len(counts) < 25
+    assert sorted(counts)[len(counts) // 2] < 20
+    assert max(counts) > 500
+
+
+def test_dataset_retweets_point_at_earlier_originals():
+    random.seed(1)
+    args = SimpleNamespace(retweet_ratio=0.3, image_ratio=0.5)
+    records = list(tweet_records(100, [1, 2, 3] * 100, [7], args))
+    originals = {record[0] for record in records if record[5] is None}
+
+    assert [record[0] for record in records] == list(range(100, 400))
+    for tweet_id, text, has_image, image_id, owner_id, original_id, version, like_count in records:
+        if original_id is not None:
+            assert original_id in originals and original_id < tweet_id
+            assert text is None and not has_image
+        else:
+            assert has_image == (image_id == 7)
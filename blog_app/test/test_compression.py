@@ -0,0 +1,98 @@
+import gzip
+
+import brotli
+from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from fastapi.testclient import TestClient
+
+from ..compression import CompressionMiddleware, COMPRESSION_MIN_SIZE
+
+PAGE = "<li>tweet card</li>\n" * 200
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware)
+
+
+@app.get("/page")
+def page():
+    return PlainTextResponse(PAGE, headers={"ETag": '"abc"'})
+
+
+@app.get("/small")
+def small():
+    return PlainTextResponse("x" * (COMPRESSION_MIN_SIZE - 1))
+
+
+@app.get("/varied")
+def varied():
+    return PlainTextResponse(PAGE, headers={"Vary": "accept-encoding, Cookie"})
+
+
+@app.get("/image")
+def image():
+    return Response(b"\x89PNG" + b"\0" * 5000, media_type="image/png")
+
+
+@app.get("/stream")
+def stream():
+    async def chunks():
+        for _ in range(4):
+            yield PAGE
+
+    return StreamingResponse(chunks(), media_type="text/html")
+
+
+client = TestClient(app)
+
+
+def raw_get(path, encoding):
+    # httpx would decode the body, the test wants the bytes on the wire
+    with client.stream("GET", path, headers={"Accept-Encoding": encoding}) as response:
+        return response, b"".join(response.iter_raw())
+
+
+def test_gzip_whole_body():
+    response, body = raw_get("/page", "gzip")
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["content-length"] == str(len(body))
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.headers["etag"] == 'W/"abc"'
+    assert gzip.decompress(body).decode() == PAGE
+
+
+def test_brotli_is_preferred():
+    response, body = raw_get("/page", "gzip, deflate, br")
+
+    assert response.headers["content-encoding"] == "br"
+    assert brotli.decompress(body).decode() == PAGE
+
+
+def test_small_and_binary_bodies_are_not_compressed():
+    small, _ = raw_get("/small", "gzip")
+    image, _ = raw_get("/image", "gzip")
+    identity, _ = raw_get("/page", "identity")
+
+    assert "content-encoding" not in small.headers
+    assert "content-encoding" not in image.headers
+    assert "vary" not in image.headers
+    assert "content-encoding" not in identity.headers
+    assert identity.headers["vary"] == "Accept-Encoding"
+
+
+def test_streamed_body_is_compressed_in_chunks():
+    response, body = raw_get("/stream", "gzip")
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert "content-length" not in response.headers
+    assert gzip.decompress(body).decode() == PAGE * 4
+
+
+def test_vary_is_not_repeated():
+    response, body = raw_get("/varied", "gzip")
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "accept-encoding, Cookie"
+
+    response, body = raw_get("/page", "gzip")
+    assert response.headers["vary"] == "Accept-Encoding"
@@ -0,0 +1,24 @@
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+from .. import database
+from ..database import normalize_database_url, StickyPrimaryMiddleware, STICKY_PRIMARY_COOKIE
+
+
+def test_normalize_database_url():
+    expected = 'postgresql+asyncpg://postgres:secret@db:5432/app'
+
+    assert normalize_database_url('postgres://postgres:secret@db:5432/app') == expected
+    assert normalize_database_url('postgresql://postgres:secret@db:5432/app') == expected
+    assert normalize_database_url(expected) == expected
+
+
+def test_sticky_primary_cookie_after_write(monkeypatch):
+    monkeypatch.setattr(database, 'read_engine', object())
+    app = Starlette(routes=[Route('/', lambda request: PlainTextResponse('ok'), methods=['GET', 'POST'])])
+    client = TestClient(StickyPrimaryMiddleware(app))
+
+    assert STICKY_PRIMARY_COOKIE not in client.get('/').cookies
+    assert STICKY_PRIMARY_COOKIE in client.post('/').cookies
@@ -0,0 +1,76 @@
+from ..fragments import FragmentCache, render_cards, local_cache, VIEWER_ACTIONS, LIKE_BUTTON
+import pytest
+
+
+def make_tweet(tweet_id, owner_id=1, version=1, text="Hello"):
+    return {'id': tweet_id, 'original_id': None, 'new_tweet': text, 'has_image': False, 'image_id': None,
+            'owner_id': owner_id, 'retweeted': False, 'op_id': None, 'op_username': None,
+            'username': 'testuser', 'has_pp': False, 'image': None, 'avatar': None, 'op_avatar': None,
+            'version': version, 'like_count': 3}
+
+
+def test_fragment_cache_versions():
+    cache = FragmentCache(2)
+    cache.set(1, 1, "<li>one</li>")
+
+    assert cache.get(1, 1) == "<li>one</li>"
+    assert cache.get(1, 2) is None
+
+    cache.discard(1)
+    assert cache.get(1, 1) is None
+
+
+def test_fragment_cache_evicts_least_recently_used():
+    cache = FragmentCache(2)
+    cache.set(1, 1, "one")
+    cache.set(2, 1, "two")
+    cache.get(1, 1)
+    cache.set(3, 1, "three")
+
+    assert len(cache) == 2
+    assert cache.get(2, 1) is None
+    assert cache.get(1, 1) == "one"
+
+
+@pytest.mark.asyncio
+async def test_render_cards_splices_viewer_actions():
+    tweets = [make_tweet(901, owner_id=1), make_tweet(902, owner_id=2)]
+
+    cards = await render_cards(tweets, {'username': 'testuser', 'id': 1})
+
+    assert "/tweets/edit_tweet/901" in cards[0]
+    assert "/tweets/edit_tweet/902" not in cards[1]
+    assert VIEWER_ACTIONS not in cards[0]
+    assert local_cache.get(901, 1) is not None
+
+
+@pytest.mark.asyncio
+async def test_render_cards_rerenders_new_version():
+    await render_cards([make_tweet(903, text="Before")], {'id': 1})
+
+    cards = await render_cards([make_tweet(903, version=2, text="After")], {'id': 1})
+
+    assert "After" in cards[0]
+
+
+@pytest.mark.asyncio
+async def test_render_cards_image_srcset():
+    tweet = make_tweet(904)
+    tweet.update(has_image=True, image='ab/abcdef', has_pp=True, avatar='12/123456')
+
+    cards = await render_cards([tweet], {'id': 1})
+
+    assert '/static/images/tweets/ab/abcdef_320.webp 320w' in cards[0]
+    assert '/static/images/avas/12/123456_48.webp 48w' in cards[0]
+    assert 'src="/static/images/tweets/ab/abcdef.png"' in cards[0]
+
+
+@pytest.mark.asyncio
+async def test_render_cards_splices_like_state():
+    tweets = [make_tweet(905), make_tweet(906)]
+
+    cards = await render_cards(tweets, {'id': 1}, liked_ids={905})
+
+    assert "Unlike (3)" in cards[0]
+    assert "Like (3)" in cards[1] and "Unlike" not in cards[1]
+    assert LIKE_BUTTON not in cards[0]
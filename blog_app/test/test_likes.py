@@ -0,0 +1,89 @@
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+
+from .utils import *
+from .. import likes, timeline
+from ..feed import hydrate
+from ..routers import api
+import pytest
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    client = FakeRedis(server=FakeServer(), decode_responses=True)
+    monkeypatch.setattr(likes, 'redis_client', client)
+    monkeypatch.setattr(timeline, 'redis_client', client)
+    monkeypatch.setattr(timeline, 'TIMELINE_CACHE_ENABLED', True)
+    yield client
+
+
+@pytest.fixture
+def retweeted(test_user):
+    db = TestingSessionLocal()
+    original = Tweets(new_tweet="Original", owner_id=test_user.id)
+    db.add(original)
+    db.commit()
+    retweet = Tweets(owner_id=test_user.id, original_id=original.id)
+    db.add(retweet)
+    db.commit()
+    ids = original.id, retweet.id
+    db.close()
+    yield ids
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM likes;"))
+        connection.execute(text("DELETE FROM like_flushes;"))
+        connection.execute(text("DELETE FROM tweets;"))
+        connection.commit()
+
+
+async def like_counts(ids):
+    async with AsyncTestingSessionLocal() as db:
+        return [payload['like_count'] for payload in await hydrate(db, ids)]
+
+
+@pytest.mark.asyncio
+async def test_flush_refreshes_retweet_payloads(fake_redis, retweeted, test_user):
+    original_id, retweet_id = retweeted
+
+    # Both payloads are cached before the like, each with a count of 0
+    assert await like_counts([retweet_id, original_id]) == [0, 0]
+
+    # Called directly, the fake Redis client cannot be shared with the TestClient's event loop
+    async with AsyncTestingSessionLocal() as db:
+        assert await api.like_tweet(retweet_id, db, {'username': 'testuser', 'id': test_user.id}) == {'liked': True}
+        assert await likes.flush_like_counts(db, fake_redis) == 1
+
+    assert await timeline.get_payloads([retweet_id, original_id]) == [None, None]
+    assert await like_counts([retweet_id, original_id]) == [1, 1]
+
+
+@pytest.mark.asyncio
+async def test_overlapping_flush_is_skipped(fake_redis, retweeted):
+    original_id, _ = retweeted
+    await fake_redis.hincrby(likes.PENDING_LIKES, str(original_id), 1)
+    await fake_redis.set(likes.FLUSH_LOCK, 'another worker')
+
+    async with AsyncTestingSessionLocal() as db:
+        assert await likes.flush_like_counts(db, fake_redis) == 0
+
+    assert await fake_redis.hgetall(likes.PENDING_LIKES) == {str(original_id): '1'}
+
+
+@pytest.mark.asyncio
+async def test_hash_is_applied_once(fake_redis, retweeted):
+    original_id, _ = retweeted
+    await fake_redis.hincrby(likes.PENDING_LIKES, str(original_id), 1)
+
+    async with AsyncTestingSessionLocal() as db:
+        assert await likes.flush_like_counts(db, fake_redis) == 1
+
+    # As if the worker died between the commit and deleting the hash
+    with engine.connect() as connection:
+        key = connection.execute(text("SELECT key FROM like_flushes")).scalar_one()
+    await fake_redis.hset(key, str(original_id), 1)
+
+    async with AsyncTestingSessionLocal() as db:
+        assert await likes.flush_like_counts(db, fake_redis) == 0
+        assert (await db.get(Tweets, original_id)).like_count == 1
+    assert not await fake_redis.exists(key)
+    assert not await fake_redis.exists(likes.FLUSH_LOCK)
@@ -1,5 +1,7 @@
 from fastapi.testclient import TestClient
 from ..main import app
+from .. import static_files
+from ..static_files import is_content_addressed, accepted_encodings, precompress, CachedStaticFiles
 
 client = TestClient(app)
 
@@ -7,4 +9,53 @@ def test_root():
     response = client.get("/", allow_redirects=False)
 
     assert response.status_code == 302
-    assert response.headers["location"] == "/tweets"
\ No newline at end of file
+    assert response.headers["location"] == "/tweets"
+
+def test_legacy_image_is_revalidated():
+    response = client.get("/static/images/tweets/23.png")
+
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "public, no-cache"
+
+
+def test_content_addressed_images_are_immutable():
+    digest = "ab" * 32
+
+    assert is_content_addressed(f"/app/blog_app/static/images/tweets/ab/{digest}.png")
+    assert is_content_addressed(f"/app/blog_app/static/images/avas/ab/{digest}_96.webp")
+    assert not is_content_addressed("/app/blog_app/static/images/tweets/23.png")
+    assert not is_content_addressed("/app/blog_app/static/todo/css/base.css")
+
+
+def test_accepted_encodings():
+    assert accepted_encodings("gzip, deflate, br") == {"gzip", "deflate", "br"}
+    assert accepted_encodings("br;q=0, gzip;q=0.5") == {"gzip"}
+    assert accepted_encodings("") == set()
+
+
+def test_precompressed_sibling_is_served(tmp_path):
+    css = "body { color: red; }\n" * 200
+    (tmp_path / "app.css").write_text(css)
+    precompress(str(tmp_path))
+    static_client = TestClient(CachedStaticFiles(directory=tmp_path))
+
+    compressed = static_client.get("/app.css", headers={"Accept-Encoding": "gzip"})
+    plain = static_client.get("/app.css", headers={"Accept-Encoding": "identity"})
+
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["content-type"].startswith("text/css")
+    assert compressed.headers["vary"] == "Accept-Encoding"
+    assert compressed.text == css
+    assert "content-encoding" not in plain.headers
+    assert plain.headers["etag"] != compressed.headers["etag"]
+
+
+def test_offload_only_sends_a_header(tmp_path, monkeypatch):
+    (tmp_path / "app.js").write_text("console.log(1);")
+    monkeypatch.setattr(static_files, "STATIC_OFFLOAD", "x-accel-redirect")
+    static_client = TestClient(CachedStaticFiles(directory=tmp_path))
+
+    response = static_client.get("/app.js")
+
+    assert response.headers["x-accel-redirect"] == "/protected-static/app.js"
+    assert response.content == b""
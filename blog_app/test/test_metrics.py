@@ -0,0 +1,48 @@
+from prometheus_client import REGISTRY
+
+from .utils import *
+from ..sql_timing import instrument_engine
+from ..routers.tweets import get_db, get_read_db, get_read_sessionmaker, get_authenticated_user
+
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+app.dependency_overrides[get_read_sessionmaker] = lambda: AsyncTestingSessionLocal
+app.dependency_overrides[get_authenticated_user] = override_get_current_user
+
+# Requests run on the test engine, which the app never instrumented
+instrument_engine(async_engine)
+
+
+def test_metrics_label_route_templates():
+    client.get("/auth/")
+    client.get("/no/such/page")
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert 'http_requests_total{method="GET",route="/auth/",status="200"}' in response.text
+    assert 'route="<unmatched>",status="404"' in response.text
+    assert 'route="/no/such/page"' not in response.text
+
+
+def test_metrics_count_queries_per_request(test_user):
+    db = TestingSessionLocal()
+    db.add(Tweets(new_tweet="Counted", owner_id=test_user.id))
+    db.commit()
+    db.close()
+    labels = {'route': '/tweets/users/{user_id}'}
+    before = REGISTRY.get_sample_value('db_queries_per_request_sum', labels) or 0
+
+    with count_queries() as statements:
+        response = client.get(f"/tweets/users/{test_user.id}")
+
+    assert response.status_code == 200
+    # the page itself and the viewer's likes
+    assert len(statements) == 2
+    assert REGISTRY.get_sample_value('db_queries_per_request_sum', labels) - before == len(statements)
+    assert 'db_queries_per_request_count{route="/tweets/users/{user_id}"}' in client.get("/metrics").text
+
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM tweets;"))
+        connection.commit()
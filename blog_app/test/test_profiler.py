@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+from ..metrics import QueryStats
+from ..profiler import statement_shape, RequestProfile
+from ..sql_timing import _after_cursor_execute, _before_cursor_execute, recording
+
+
+def test_statement_shape_ignores_parameters():
+    first = "SELECT users.id FROM users WHERE users.id IN ($1::INTEGER, $2::INTEGER)"
+    second = "SELECT users.id\nFROM users WHERE users.id IN ($1::INTEGER)"
+
+    assert statement_shape(first) == statement_shape(second)
+
+
+def test_repeated_shapes_over_threshold():
+    profile = RequestProfile()
+    for user_id in range(6):
+        profile.add("SELECT users.username FROM users WHERE users.id = $1::INTEGER", (user_id,), 0.001)
+    profile.add("SELECT tweets.id FROM tweets LIMIT $1::INTEGER", (21,), 0.002)
+
+    repeated = profile.repeated_shapes(threshold=5)
+
+    assert repeated == [("SELECT users.username FROM users WHERE users.id = ?", 6)]
+    assert profile.summary().startswith("queries=7; time=8.0ms")
+
+
+def test_one_listener_feeds_metrics_and_profiler():
+    stats, profile = QueryStats(), RequestProfile()
+    context = SimpleNamespace()
+
+    with recording(stats), recording(profile):
+        _before_cursor_execute(None, None, "SELECT 1", (), context, False)
+        _after_cursor_execute(None, None, "SELECT 1", (), context, False)
+    # Outside of a request nothing is recorded
+    _before_cursor_execute(None, None, "SELECT 2", (), context, False)
+    _after_cursor_execute(None, None, "SELECT 2", (), context, False)
+
+    assert stats.count == 1
+    assert [statement for statement, _, _ in profile.statements] == ["SELECT 1"]
+    assert stats.duration == profile.total_time
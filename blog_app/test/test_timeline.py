@@ -0,0 +1,205 @@
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+
+from .utils import *
+from .. import database, timeline
+from ..feed import feed_query, read_page
+import pytest
+
+
+@pytest.fixture
+def redis_timeline(monkeypatch):
+    # Every test gets its own empty fake server, utils turns the cache off for everything else
+    client = FakeRedis(server=FakeServer(), decode_responses=True)
+    monkeypatch.setattr(timeline, 'redis_client', client)
+    monkeypatch.setattr(timeline, 'TIMELINE_CACHE_ENABLED', True)
+    yield client
+
+
+@pytest.fixture
+def test_tweets(test_user):
+    db = TestingSessionLocal()
+    tweets = [Tweets(new_tweet=f"Tweet number {i}", owner_id=test_user.id) for i in range(25)]
+    db.add_all(tweets)
+    db.commit()
+    ids = sorted((tweet.id for tweet in tweets), reverse=True)
+    db.close()
+    yield ids
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM tweets;"))
+        connection.commit()
+
+
+def payload(tweet_id, owner_id=1):
+    return {'id': tweet_id, 'owner_id': owner_id, 'new_tweet': f"Tweet {tweet_id}"}
+
+
+async def timeline_ids(client, key):
+    return [int(tweet_id) for tweet_id in await client.zrevrange(key, 0, -1)]
+
+
+@pytest.mark.asyncio
+async def test_cold_timeline(redis_timeline):
+    assert await timeline.read_ids(timeline.GLOBAL_TIMELINE, None, 2) is timeline.COLD
+
+    await timeline.replace_timeline(timeline.GLOBAL_TIMELINE, [payload(i) for i in (3, 2, 1)], complete=True)
+
+    assert await redis_timeline.get(f'{timeline.GLOBAL_TIMELINE}:ready') == timeline.COMPLETE
+    assert await timeline.read_ids(timeline.GLOBAL_TIMELINE, None, 2) == [3, 2, 1]
+    # A complete timeline answers pages past its end too, with fewer ids than asked for
+    assert await timeline.read_ids(timeline.GLOBAL_TIMELINE, 2, 2) == [1]
+    assert await timeline.get_payloads([2, 4]) == [payload(2), None]
+
+
+@pytest.mark.asyncio
+async def test_truncated_window(redis_timeline, monkeypatch):
+    monkeypatch.setattr(timeline, 'TIMELINE_MAX_LENGTH', 3)
+
+    await timeline.replace_timeline(timeline.GLOBAL_TIMELINE, [payload(i) for i in range(5, 0, -1)], complete=True)
+
+    assert await redis_timeline.get(f'{timeline.GLOBAL_TIMELINE}:ready') == timeline.TRUNCATED
+    assert await timeline_ids(redis_timeline, timeline.GLOBAL_TIMELINE) == [5, 4, 3]
+    assert await timeline.read_ids(timeline.GLOBAL_TIMELINE, None, 2) == [5, 4, 3]
+    # Only 3 is left below 4, the rest of the page is older than the window
+    assert await timeline.read_ids(timeline.GLOBAL_TIMELINE, 4, 2) is None
+
+
+@pytest.mark.asyncio
+async def test_replace_timeline_merge(redis_timeline):
+    key = timeline.user_timeline(1)
+    await redis_timeline.zadd(key, {10: 10})
+
+    # Tweet 10 was pushed while the rebuild query ran, the merge keeps it
+    await timeline.replace_timeline(key, [payload(2), payload(1)], complete=True)
+    assert await timeline_ids(redis_timeline, key) == [10, 2, 1]
+
+    await timeline.replace_timeline(key, [payload(2), payload(1)], complete=True, merge=False)
+    assert await timeline_ids(redis_timeline, key) == [2, 1]
+    assert not await redis_timeline.exists(f'{key}:rebuild')
+
+
+@pytest.mark.asyncio
+async def test_push_tweet_trims(redis_timeline, monkeypatch):
+    monkeypatch.setattr(timeline, 'TIMELINE_MAX_LENGTH', 2)
+    await timeline.replace_timeline(timeline.GLOBAL_TIMELINE, [payload(2), payload(1)], complete=True)
+    changes = int(await redis_timeline.get(timeline.CHANGES) or 0)
+
+    await timeline.push_tweet(payload(3))
+
+    assert await timeline_ids(redis_timeline, timeline.GLOBAL_TIMELINE) == [3, 2]
+    assert await redis_timeline.get(f'{timeline.GLOBAL_TIMELINE}:ready') == timeline.TRUNCATED
+    assert int(await redis_timeline.get(timeline.CHANGES)) == changes + 1
+    assert await timeline.get_payloads([3]) == [payload(3)]
+    # The owner's timeline was never built, a push must not mark it ready
+    assert await timeline_ids(redis_timeline, timeline.user_timeline(1)) == [3]
+    assert await redis_timeline.get(f'{timeline.user_timeline(1)}:ready') is None
+
+
+@pytest.mark.asyncio
+async def test_remove_and_forget_tweets(redis_timeline):
+    for tweet_id in (1, 2, 3):
+        await timeline.push_tweet(payload(tweet_id))
+    changes = int(await redis_timeline.get(timeline.CHANGES))
+
+    await timeline.remove_tweets([(2, 1)])
+
+    assert await timeline_ids(redis_timeline, timeline.GLOBAL_TIMELINE) == [3, 1]
+    assert await timeline_ids(redis_timeline, timeline.user_timeline(1)) == [3, 1]
+    assert await timeline.get_payloads([2]) == [None]
+    assert int(await redis_timeline.get(timeline.CHANGES)) == changes + 1
+
+    # An edited tweet keeps its place, only the stale payload goes
+    await timeline.forget_tweets([3])
+
+    assert await timeline_ids(redis_timeline, timeline.GLOBAL_TIMELINE) == [3, 1]
+    assert await timeline.get_payloads([3, 1]) == [None, payload(1)]
+    assert int(await redis_timeline.get(timeline.CHANGES)) == changes + 2
+
+
+@pytest.mark.asyncio
+async def test_feed_state(redis_timeline):
+    key = timeline.GLOBAL_TIMELINE
+    # The first call only seeds the change counter
+    assert await timeline.feed_state(key, 7) is None
+    assert await redis_timeline.get(timeline.CHANGES) is not None
+    # Still unknown while the timeline is cold
+    assert await timeline.feed_state(key, 7) is None
+
+    await timeline.replace_timeline(key, [payload(2), payload(1)], complete=True)
+    newest, changes, viewer_changes = await timeline.feed_state(key, 7)
+    assert (newest, viewer_changes) == ('2', None)
+
+    await timeline.touch_viewer(7)
+    await timeline.push_tweet(payload(3))
+    assert await timeline.feed_state(key, 7) == ('3', str(int(changes) + 1), '1')
+
+
+@pytest.mark.asyncio
+async def test_read_page_warms_cold_timeline(redis_timeline, test_tweets):
+    async with AsyncTestingSessionLocal() as db:
+        tweets, next_before = await read_page(db, timeline.GLOBAL_TIMELINE, feed_query(), None, 10)
+
+    assert [tweet['id'] for tweet in tweets] == test_tweets[:10]
+    assert next_before == test_tweets[9]
+    assert await timeline_ids(redis_timeline, timeline.GLOBAL_TIMELINE) == test_tweets
+    assert await redis_timeline.get(f'{timeline.GLOBAL_TIMELINE}:ready') == timeline.COMPLETE
+
+    # Warm now: ids and payloads both come from Redis
+    async with AsyncTestingSessionLocal() as db:
+        with count_queries() as statements:
+            tweets, next_before = await read_page(db, timeline.GLOBAL_TIMELINE, feed_query(), next_before, 10)
+    assert [tweet['id'] for tweet in tweets] == test_tweets[10:20]
+    assert statements == []
+
+
+@pytest.mark.asyncio
+async def test_read_page_warms_from_primary(redis_timeline, test_tweets, monkeypatch):
+    opened = []
+
+    def primary_session():
+        opened.append(True)
+        return AsyncTestingSessionLocal()
+
+    monkeypatch.setattr(database, 'SessionLocal', primary_session)
+    replica = async_sessionmaker(bind=async_engine, class_=AsyncSession, expire_on_commit=False,
+                                 info={'replica': True})
+
+    async with replica() as db:
+        tweets, next_before = await read_page(db, timeline.GLOBAL_TIMELINE, feed_query(), None, 10)
+
+    assert [tweet['id'] for tweet in tweets] == test_tweets[:10]
+    assert opened == [True]
+    assert await redis_timeline.get(f'{timeline.GLOBAL_TIMELINE}:ready') == timeline.COMPLETE
+    # Loaded from the primary, so cached for the full TTL rather than the replica's
+    assert await redis_timeline.ttl(timeline._tweet_key(test_tweets[0])) > timeline.REPLICA_PAYLOAD_TTL
+
+
+@pytest.mark.asyncio
+async def test_read_page_past_truncated_window(redis_timeline, test_tweets, monkeypatch):
+    monkeypatch.setattr(timeline, 'TIMELINE_MAX_LENGTH', 15)
+
+    async with AsyncTestingSessionLocal() as db:
+        tweets, next_before = await read_page(db, timeline.GLOBAL_TIMELINE, feed_query(), None, 10)
+        assert [tweet['id'] for tweet in tweets] == test_tweets[:10]
+        assert await redis_timeline.get(f'{timeline.GLOBAL_TIMELINE}:ready') == timeline.TRUNCATED
+
+        # Half of the second page is older than the cached window, so Postgres serves all of it
+        with count_queries() as statements:
+            tweets, next_before = await read_page(db, timeline.GLOBAL_TIMELINE, feed_query(), next_before, 10)
+    assert [tweet['id'] for tweet in tweets] == test_tweets[10:20]
+    assert next_before == test_tweets[19]
+    assert len(statements) == 1
+
+
+@pytest.mark.asyncio
+async def test_rebuild(redis_timeline, test_tweets, test_user, monkeypatch):
+    monkeypatch.setattr(database, 'SessionLocal', AsyncTestingSessionLocal)
+    # Left behind by a tweet deleted while Redis was unreachable
+    await redis_timeline.zadd(timeline.GLOBAL_TIMELINE, {999999: 999999})
+
+    await timeline.rebuild()
+
+    assert await timeline_ids(redis_timeline, timeline.GLOBAL_TIMELINE) == test_tweets
+    assert await timeline_ids(redis_timeline, timeline.user_timeline(test_user.id)) == test_tweets
+    assert await redis_timeline.get(f'{timeline.user_timeline(test_user.id)}:ready') == timeline.COMPLETE
+    assert [payload['id'] for payload in await timeline.get_payloads(test_tweets[:3])] == test_tweets[:3]
@@ -0,0 +1,244 @@
+from sqlalchemy import select
+
+from .utils import *
+from ..routers.tweets import get_db, get_read_db, get_read_sessionmaker, get_authenticated_user, FEED_PAGE_SIZE
+from ..feed import feed_query, paginate_tweets, stream_page, etag_matches, cache_headers
+import pytest
+
+
+app.dependency_overrides[get_db] = override_get_db
+app.dependency_overrides[get_read_db] = override_get_db
+app.dependency_overrides[get_read_sessionmaker] = lambda: AsyncTestingSessionLocal
+app.dependency_overrides[get_authenticated_user] = override_get_current_user
+
+
+@pytest.fixture
+def test_tweets(test_user):
+    db = TestingSessionLocal()
+    tweets = [Tweets(new_tweet=f"Tweet number {i}", owner_id=test_user.id) for i in range(25)]
+    db.add_all(tweets)
+    db.commit()
+    ids = sorted((tweet.id for tweet in tweets), reverse=True)
+    db.close()
+    yield ids
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM tweets;"))
+        connection.commit()
+
+
+@pytest.mark.asyncio
+async def test_paginate_tweets(test_tweets):
+    async with AsyncTestingSessionLocal() as db:
+        first_page, next_before = await paginate_tweets(db, select(Tweets), None, 10)
+        assert [tweet.id for tweet in first_page] == test_tweets[:10]
+        assert next_before == test_tweets[9]
+
+        second_page, next_before = await paginate_tweets(db, select(Tweets), next_before, 10)
+        assert [tweet.id for tweet in second_page] == test_tweets[10:20]
+
+        last_page, next_before = await paginate_tweets(db, select(Tweets), next_before, 10)
+        assert [tweet.id for tweet in last_page] == test_tweets[20:]
+        assert next_before is None
+
+
+@pytest.mark.asyncio
+async def test_stream_page_matches_paginate(test_tweets):
+    async with AsyncTestingSessionLocal() as db:
+        page = {'next_before': None}
+        chunks = [chunk async for chunk in stream_page(db, feed_query(), None, 10, 4, page)]
+
+        assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+        assert [tweet['id'] for chunk in chunks for tweet in chunk] == test_tweets[:10]
+        assert page['next_before'] == test_tweets[9]
+
+        page = {'next_before': None}
+        chunks = [chunk async for chunk in stream_page(db, feed_query(), test_tweets[19], 10, 4, page)]
+
+        assert [tweet['id'] for chunk in chunks for tweet in chunk] == test_tweets[20:]
+        assert page['next_before'] is None
+
+
+def test_long_feed_page_is_streamed(test_tweets):
+    response = client.get("/tweets/?limit=60")
+
+    assert response.status_code == 200
+    assert "content-length" not in response.headers
+    assert all(f"Tweet number {i}" in response.text for i in range(25))
+    assert "reached the end of the feed" in response.text
+
+
+def test_read_all_first_page(test_tweets):
+    response = client.get("/tweets")
+    assert response.status_code == 200
+    assert f"?before={test_tweets[FEED_PAGE_SIZE - 1]}&limit={FEED_PAGE_SIZE}" in response.text
+    assert "Tweet number 24" in response.text
+    assert "Tweet number 4<" not in response.text
+
+
+def test_read_all_last_page(test_tweets):
+    response = client.get(f"/tweets?before={test_tweets[19]}&limit=10")
+    assert response.status_code == 200
+    assert "Tweet number 4<" in response.text
+    assert "You've reached the end of the feed" in response.text
+
+
+def test_read_all_invalid_limit():
+    response = client.get("/tweets?limit=0")
+    assert response.status_code == 422
+
+
+@pytest.fixture
+def test_retweets(test_user):
+    db = TestingSessionLocal()
+    other_user = Users(email="other@example.com", username="otheruser", first_name="Other", last_name="User",
+                       hashed_password=test_user.hashed_password, has_pp=True, is_active=True,
+                       phone_number="0987654321")
+    db.add(other_user)
+    db.commit()
+
+    originals = [Tweets(new_tweet=f"Tweet number {i}", owner_id=other_user.id) for i in range(20)]
+    db.add_all(originals)
+    db.commit()
+
+    retweets = [Tweets(owner_id=test_user.id, original_id=original.id) for original in originals[::2]]
+    db.add_all(retweets)
+    db.commit()
+    tweets = [(tweet.id, tweet.original_id) for tweet in originals + retweets]
+    db.close()
+    yield tweets
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM tweets;"))
+        connection.commit()
+
+
+@pytest.mark.parametrize("limit", [5, 30])
+def test_read_all_query_count(test_retweets, limit):
+    with count_queries() as statements:
+        response = client.get(f"/tweets?limit={limit}")
+
+    assert response.status_code == 200
+    assert "otheruser" in response.text
+    # the page itself and the viewer's likes
+    assert len(statements) == 2
+
+
+def test_read_all_by_user_query_count(test_retweets, test_user):
+    with count_queries() as statements:
+        response = client.get(f"/tweets/users/{test_user.id}?limit=30")
+
+    assert response.status_code == 200
+    assert "Retweeted by @testuser" in response.text
+    assert "Tweet number 18" in response.text
+    # the page itself and the viewer's likes
+    assert len(statements) == 2
+
+
+@pytest.fixture
+def as_test_user(test_user):
+    app.dependency_overrides[get_authenticated_user] = lambda: {'username': 'testuser', 'id': test_user.id}
+    yield test_user
+    app.dependency_overrides[get_authenticated_user] = override_get_current_user
+
+
+def test_like_tweet_toggles(test_tweets, as_test_user):
+    tweet_id = test_tweets[0]
+
+    response = client.post(f"/tweets/like/{tweet_id}")
+    assert response.status_code == 200
+    assert response.json()['liked'] is True
+
+    db = TestingSessionLocal()
+    assert db.get(Likes, (as_test_user.id, tweet_id)) is not None
+    db.close()
+
+    response = client.post(f"/tweets/like/{tweet_id}")
+    assert response.json()['liked'] is False
+
+    db = TestingSessionLocal()
+    assert db.get(Likes, (as_test_user.id, tweet_id)) is None
+    db.close()
+
+
+def test_like_through_retweet(test_retweets, as_test_user):
+    retweet_id, original_id = test_retweets[-1]
+
+    response = client.post(f"/tweets/like/{retweet_id}")
+    assert response.json()['liked'] is True
+
+    db = TestingSessionLocal()
+    assert db.get(Likes, (as_test_user.id, original_id)) is not None
+    assert db.get(Likes, (as_test_user.id, retweet_id)) is None
+    db.close()
+
+    # Liking the original now unlikes it, it is the same like
+    response = client.post(f"/tweets/like/{original_id}")
+    assert response.json()['liked'] is False
+
+
+def test_like_missing_tweet(as_test_user):
+    response = client.post("/tweets/like/999999")
+    assert response.status_code == 404
+
+
+def test_retweet_points_at_original(test_retweets, as_test_user):
+    retweet_id, original_id = test_retweets[-1]
+
+    response = client.post(f"/tweets/retweet/{retweet_id}", follow_redirects=False)
+    assert response.status_code == 302
+
+    db = TestingSessionLocal()
+    newest = db.scalar(select(Tweets).order_by(Tweets.id.desc()).limit(1))
+    assert newest.original_id == original_id
+    assert newest.new_tweet is None
+    db.close()
+
+
+@pytest.fixture
+def searchable_tweets(test_user):
+    db = TestingSessionLocal()
+    texts = ["Postgres full text search is fast", "Searching with postgres", "Nothing to see here",
+             "search search search"]
+    db.add_all([Tweets(new_tweet=text_, owner_id=test_user.id) for text_ in texts])
+    db.commit()
+    db.close()
+    yield texts
+    with engine.connect() as connection:
+        connection.execute(text("DELETE FROM tweets;"))
+        connection.commit()
+
+
+def test_search_ranks_matches(searchable_tweets):
+    response = client.get("/tweets/search?q=search")
+
+    assert response.status_code == 200
+    assert "search search search" in response.text
+    assert "Nothing to see here" not in response.text
+    assert response.text.index("search search search") < response.text.index("Postgres full text search")
+
+
+def test_search_pagination(searchable_tweets):
+    response = client.get("/tweets/search?q=postgres&limit=1")
+
+    assert response.status_code == 200
+    assert "More results" in response.text
+    assert "?q=postgres&rank=" in response.text
+
+
+def test_etag_matches_weakly():
+    etag = 'W/"abc"'
+
+    assert etag_matches('W/"abc"', etag)
+    assert etag_matches('"xyz", "abc"', etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches('W/"xyz"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches('W/"abc"', None)
+
+
+def test_feed_is_revalidated_without_etag_when_cache_is_off(as_test_user):
+    # With the timeline cache disabled there is no change counter to build an ETag from
+    response = client.get("/tweets/", headers={"If-None-Match": "*"})
+
+    assert response.status_code == 200
+    assert "etag" not in response.headers
+    assert response.headers["cache-control"] == cache_headers(None)["Cache-Control"]
@@ -0,0 +1,252 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+from redis.exceptions import RedisError
+
+from .cache import redis_client
+
+logger = logging.getLogger(__name__)
+
+TIMELINE_CACHE_ENABLED = os.getenv('TIMELINE_CACHE_ENABLED', 'true').lower() == 'true'
+TIMELINE_MAX_LENGTH = int(os.getenv('TIMELINE_MAX_LENGTH', 1000))
+TWEET_CACHE_TTL = int(os.getenv('TWEET_CACHE_TTL', 24 * 3600))
+# Payloads loaded from a read replica may predate an edit that was just forgotten, so they are
+# only kept briefly
+REPLICA_PAYLOAD_TTL = int(os.getenv('REPLICA_PAYLOAD_TTL', 60))
+
+GLOBAL_TIMELINE = 'timeline:global'
+
+# Bumped by every write that changes what an already rendered feed page shows (new tweets,
+# edits, deletes, like counts); a viewer's own counter covers their liked buttons
+CHANGES = 'feed:changes'
+
+# Bumped whenever Tweets.to_dict changes shape, so payloads cached by an older deploy are ignored
+PAYLOAD_VERSION = 4
+
+# Returned by read_ids when a timeline has never been built (or Redis was flushed)
+COLD = object()
+
+# Values of the "<timeline>:ready" marker. A complete timeline holds every tweet it covers,
+# a truncated one has been capped and older pages have to come from Postgres.
+COMPLETE = '1'
+TRUNCATED = '0'
+
+
+def user_timeline(user_id: int) -> str:
+    return f'timeline:user:{user_id}'
+
+
+def _ready_key(key: str) -> str:
+    return f'{key}:ready'
+
+
+def _tweet_key(tweet_id: int) -> str:
+    return f'tweet:v{PAYLOAD_VERSION}:{tweet_id}'
+
+
+def _viewer_changes_key(user_id) -> str:
+    return f'{CHANGES}:user:{user_id}'
+
+
+async def feed_state(key: str, user_id):
+    # (newest id, change counter, viewer's change counter) of a timeline, or None when the
+    # state is unknown and a page has to be rendered
+    if not TIMELINE_CACHE_ENABLED:
+        return None
+
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(_ready_key(key))
+        pipe.zrevrange(key, 0, 0)
+        pipe.mget(CHANGES, _viewer_changes_key(user_id))
+        ready, newest, (changes, viewer_changes) = await pipe.execute()
+        if changes is None:
+            # Counters start from the clock, so after a Redis flush they never repeat an old value
+            await redis_client.set(CHANGES, int(time.time() * 1000), nx=True)
+            return None
+    except RedisError as e:
+        logger.warning(f"Reading feed state failed for {key}: {e}")
+        return None
+
+    if ready is None:
+        return None
+    return (newest[0] if newest else None), changes, viewer_changes
+
+
+async def touch_viewer(user_id):
+    if not TIMELINE_CACHE_ENABLED:
+        return
+
+    try:
+        await redis_client.incr(_viewer_changes_key(user_id))
+    except RedisError as e:
+        logger.warning(f"Bumping the feed change counter of user {user_id} failed: {e}")
+
+
+async def read_ids(key: str, before, limit: int):
+    if not TIMELINE_CACHE_ENABLED:
+        return None
+
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(_ready_key(key))
+        pipe.zrevrangebyscore(key, f'({before}' if before else '+inf', '-inf', start=0, num=limit + 1)
+        ready, ids = await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Timeline read failed for {key}: {e}")
+        return None
+
+    if ready is None:
+        return COLD
+    if len(ids) <= limit and ready == TRUNCATED:
+        # The page runs past the capped window, the rest of it only lives in Postgres
+        return None
+
+    return [int(tweet_id) for tweet_id in ids]
+
+
+async def get_payloads(ids):
+    if not ids:
+        return []
+
+    try:
+        values = await redis_client.mget([_tweet_key(tweet_id) for tweet_id in ids])
+    except RedisError as e:
+        logger.warning(f"Tweet payload multi-get failed: {e}")
+        return [None] * len(ids)
+
+    return [json.loads(value) if value else None for value in values]
+
+
+async def store_payloads(payloads, ttl: int = None):
+    if not TIMELINE_CACHE_ENABLED or not payloads:
+        return
+
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for payload in payloads:
+            pipe.set(_tweet_key(payload['id']), json.dumps(payload), ex=ttl or TWEET_CACHE_TTL)
+        await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Storing tweet payloads failed: {e}")
+
+
+async def replace_timeline(key: str, payloads, complete: bool, merge: bool = True, payload_ttl: int = None):
+    # Rebuilds are written to a scratch key and unioned in, so tweets pushed while the
+    # rebuild query was running are not lost. A full rebuild (merge=False) starts clean.
+    if not TIMELINE_CACHE_ENABLED:
+        return
+
+    scratch = f'{key}:rebuild'
+    try:
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.delete(scratch)
+        if payloads:
+            pipe.zadd(scratch, {payload['id']: payload['id'] for payload in payloads})
+        if merge:
+            pipe.zunionstore(key, [key, scratch])
+        else:
+            pipe.delete(key)
+            if payloads:
+                pipe.rename(scratch, key)
+        pipe.delete(scratch)
+        pipe.zremrangebyrank(key, 0, -(TIMELINE_MAX_LENGTH + 1))
+        removed = (await pipe.execute())[-1]
+        await redis_client.set(_ready_key(key), COMPLETE if complete and not removed else TRUNCATED)
+    except RedisError as e:
+        logger.warning(f"Timeline rebuild failed for {key}: {e}")
+        return
+
+    await store_payloads(payloads, payload_ttl)
+
+
+async def push_tweet(payload: dict):
+    if not TIMELINE_CACHE_ENABLED:
+        return
+
+    keys = [GLOBAL_TIMELINE, user_timeline(payload['owner_id'])]
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.set(_tweet_key(payload['id']), json.dumps(payload), ex=TWEET_CACHE_TTL)
+        pipe.incr(CHANGES)
+        for key in keys:
+            pipe.zadd(key, {payload['id']: payload['id']})
+            pipe.zremrangebyrank(key, 0, -(TIMELINE_MAX_LENGTH + 1))
+        results = await pipe.execute()
+
+        trimmed = [key for key, removed in zip(keys, results[3::2]) if removed]
+        if trimmed:
+            pipe = redis_client.pipeline(transaction=False)
+            for key in trimmed:
+                pipe.set(_ready_key(key), TRUNCATED, xx=True)
+            await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Timeline push failed for tweet {payload['id']}: {e}")
+
+
+async def remove_tweets(tweets):
+    # tweets are (id, owner_id) pairs, a deleted tweet takes its retweets with it
+    if not TIMELINE_CACHE_ENABLED or not tweets:
+        return
+
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for tweet_id, owner_id in tweets:
+            pipe.zrem(GLOBAL_TIMELINE, tweet_id)
+            pipe.zrem(user_timeline(owner_id), tweet_id)
+            pipe.delete(_tweet_key(tweet_id))
+        pipe.incr(CHANGES)
+        await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Timeline removal failed for tweets {[tweet_id for tweet_id, _ in tweets]}: {e}")
+
+
+async def forget_tweets(ids, client=None):
+    # client lets code running outside the app's event loop (the Celery worker) pass its own
+    if not TIMELINE_CACHE_ENABLED or not ids:
+        return
+
+    try:
+        pipe = (client or redis_client).pipeline(transaction=False)
+        pipe.delete(*[_tweet_key(tweet_id) for tweet_id in ids])
+        pipe.incr(CHANGES)
+        await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Dropping cached tweet payloads failed: {e}")
+
+
+async def rebuild(user_ids=None):
+    from sqlalchemy import select
+
+    from .database import SessionLocal
+    from .feed import warm_timeline, feed_query
+    from .models import Users, Tweets
+
+    async with SessionLocal() as db:
+        if user_ids is None:
+            await warm_timeline(db, GLOBAL_TIMELINE, feed_query(), merge=False)
+            logger.info("Rebuilt the global timeline")
+            user_ids = (await db.scalars(select(Users.id).order_by(Users.id))).all()
+
+        for user_id in user_ids:
+            await warm_timeline(db, user_timeline(user_id), feed_query().where(Tweets.owner_id == user_id),
+                                merge=False)
+        logger.info(f"Rebuilt {len(user_ids)} user timelines")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the Redis timeline cache from Postgres")
+    parser.add_argument('--user-id', type=int, action='append', dest='user_ids',
+                        help="only rebuild this user's timeline (can be repeated)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    asyncio.run(rebuild(args.user_ids))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import os
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter
+
+TOKEN_CACHE_ENABLED = os.getenv('TOKEN_CACHE_ENABLED', 'true').lower() == 'true'
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+
+TOKEN_CACHE_HITS = Counter('token_cache_hits_total', 'Requests whose access token was found in the verified-token cache')
+TOKEN_CACHE_MISSES = Counter('token_cache_misses_total', 'Requests whose access token had to be decoded and verified')
+
+
+class TokenCache:
+    # Bounded LRU of raw token -> decoded claims. An entry is only ever added after the token
+    # passed signature verification, and it stops being served once the token's exp is reached.
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, token: str, now: float = None):
+        entry = self._entries.get(token)
+        if entry is not None:
+            claims, expires_at = entry
+            if expires_at > (now if now is not None else time.time()):
+                self._entries.move_to_end(token)
+                self.hits += 1
+                TOKEN_CACHE_HITS.inc()
+                return claims
+            del self._entries[token]
+
+        self.misses += 1
+        TOKEN_CACHE_MISSES.inc()
+        return None
+
+    def set(self, token: str, claims: dict):
+        expires_at = claims.get('exp')
+        if expires_at is None:
+            # Never cache a token that would not expire on its own
+            return
+
+        self._entries[token] = (claims, float(expires_at))
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+verified_tokens = TokenCache(TOKEN_CACHE_SIZE)
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import tempfile
+
+import aiofiles
+from fastapi import UploadFile
+from PIL import Image, UnidentifiedImageError
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from .images import IMAGE_ROOT
+from .models import Images
+from .tasks.tasks import compress_img
+
+# Raw uploads wait here until the Celery worker has processed them. The directory is outside
+# /static on purpose, unprocessed files must never be served.
+UPLOAD_DIR = "./blog_app/uploads/"
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_SIZE = int(os.getenv('MAX_UPLOAD_SIZE', 10 * 1024 * 1024))
+
+ALLOWED_IMAGE_FORMATS = {'PNG', 'JPEG', 'GIF', 'WEBP', 'BMP', 'TIFF'}
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+async def save_upload(file: UploadFile):
+    # Copies the upload to disk chunk by chunk, so a large image never sits in memory,
+    # and hashes it on the way for content addressing
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=UPLOAD_DIR, suffix='.upload')
+    os.close(fd)
+
+    size = 0
+    digest = hashlib.sha256()
+    try:
+        async with aiofiles.open(path, 'wb') as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_UPLOAD_SIZE:
+                    raise UploadTooLarge()
+                digest.update(chunk)
+                await out.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+
+    return path, digest.hexdigest()
+
+
+def _sniff_image(path: str) -> str:
+    # Image.open only parses the header, pixel data is decoded later by the worker
+    with Image.open(path) as image:
+        if image.format not in ALLOWED_IMAGE_FORMATS:
+            raise UnidentifiedImageError(f"Unsupported image format {image.format}")
+        return image.format
+
+
+async def receive_image(file: UploadFile):
+    path, digest = await save_upload(file)
+    try:
+        await run_in_threadpool(_sniff_image, path)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, digest
+
+
+async def store_image(db: AsyncSession, kind: str, upload_path: str, digest: str) -> Images:
+    # Images are addressed by the hash of the uploaded bytes. A duplicate upload reuses the
+    # existing row and files and is never processed again; a new one is handed to the worker.
+    # The stem is immutable, so every URL derived from it can be cached forever.
+    stem = f"{digest[:2]}/{digest}"
+    image_id = await db.scalar(
+        insert(Images).values(kind=kind, digest=digest, stem=stem)
+        .on_conflict_do_nothing(constraint='uq_images_kind_digest')
+        .returning(Images.id)
+    )
+
+    if image_id is None:
+        os.remove(upload_path)
+        return await db.scalar(select(Images).where(Images.kind == kind, Images.digest == digest))
+
+    compress_img.delay(upload_path, os.path.join(IMAGE_ROOT, kind, f"{stem}.png"), kind)
+    return await db.get(Images, image_id)
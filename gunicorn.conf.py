@@ -0,0 +1,57 @@
+# Production server settings, loaded by gunicorn from the working directory (/app in the image).
+# Every value can be overridden from the environment.
+import multiprocessing
+import os
+import shutil
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+
+# Each uvicorn worker runs one event loop (uvloop and httptools are picked up automatically),
+# so one worker per core keeps every core busy. Remember that every worker has its own
+# database pool of DB_POOL_SIZE + DB_MAX_OVERFLOW connections.
+worker_class = 'uvicorn.workers.UvicornWorker'
+workers = int(os.getenv('WEB_CONCURRENCY', max(2, multiprocessing.cpu_count())))
+
+# Imports the app once in the master and forks it, workers start faster and share memory.
+# Nothing connects at import time, pools and clients open their connections in each worker.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Recycle workers now and then to contain slow leaks; the jitter keeps them from all
+# restarting at the same moment
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+
+# Seconds an idle keep-alive connection stays open; keep it above the idle timeout of the
+# load balancer in front (commonly 60s) so it never reuses a connection the worker just closed
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 75))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+# Metrics of all workers are collected through files in this directory, it has to be set
+# before the app (and prometheus_client) is imported
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus-multiproc')
+os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+
+def on_starting(server):
+    # Runs once in the master before any worker is forked: drops files left by a previous run
+    # and the samples the master wrote while preloading the app, it never serves requests
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+
+def post_fork(server, worker):
+    # The gauges the master set while preloading were dropped in on_starting
+    from blog_app.database import report_pools
+
+    report_pools()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,7 @@
+#!/bin/sh
+# Production server by default, DEV_RELOAD=true runs a single uvicorn process that reloads on changes
+if [ "$DEV_RELOAD" = "true" ]; then
+    exec uvicorn blog_app.main:app --reload --host 0.0.0.0 --port 8000
+fi
+
+exec gunicorn blog_app.main:app